@@ -1,5 +1,5 @@
 import os
-import random
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 from flask import Flask, render_template, g, request, redirect, url_for, flash, session, jsonify
@@ -12,10 +12,30 @@ import psycopg2.extras
 # Import your custom modules
 from chatbot_logic import get_rag_response
 from ai_prompts import generate_content
+from db_pool import get_pool, enable_green_wait
+from catalog import get_catalog
+import search_engine
+from facets import get_facets
+import recommendations
+import reservations
+import jobs
+from orders import place_order, transition_order, fetch_order_history, fetch_order_details, find_order_by_key, new_idempotency_key, OutOfStock, AlreadyPlaced
+import cart_store
+from cart_pricing import price_cart, PLATFORM_FEE, FREE_SHIPPING_THRESHOLD, DELIVERY_CHARGE
+from reviews import fetch_reviews, fetch_rating_breakdown, record_rating
+import page_cache
+from fragment_cache import render_fragment, data_version, touch as touch_data_version
+from http_cache import make_etag, conditional_response
+import images
+import compression
+from pagination import encode_cursor, decode_cursor, clamp_page_size
+from change_feed import feed as change_feed
 
 # --- 1. APP SETUP & CONFIGURATION ---
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'a-super-secret-key-that-you-should-change')
+# gzip/brotli for HTML and JSON; precompressed files for /static (compress_static.py).
+compression.init_app(app)
 # Use eventlet as the async mode for Gunicorn compatibility on Render
 
 # --- THIS IS THE CRITICAL FIX ---
@@ -30,11 +50,16 @@ else:
 socketio = SocketIO(app, async_mode=async_mode)
 # --- END OF FIX ---
 
+# Let psycopg2 yield to other green threads while it waits on Postgres.
+if async_mode == 'eventlet':
+    enable_green_wait()
+
 # --- CONSTANTS ---
 REVIEWS_PER_PAGE = 4
-PLATFORM_FEE = 20
-FREE_SHIPPING_THRESHOLD = 1499
-DELIVERY_CHARGE = 50
+PRODUCTS_PER_PAGE = 24
+MAX_PRODUCTS_PER_PAGE = 60
+ORDERS_PER_PAGE = 10
+MAX_ORDERS_PER_PAGE = 50
 
 # --- 2. LOGIN MANAGER SETUP ---
 login_manager = LoginManager()
@@ -62,37 +87,75 @@ def load_user(user_id):
     return None
 
 # --- 3. DATABASE CONNECTION ---
+# Connections come from a process-wide pool (see db_pool.py) instead of a fresh
+# TCP + TLS + auth handshake per request. Routes keep using g.db as before.
 def get_db():
     if 'db' not in g:
-        # THE KEY FIX: Append '?sslmode=require' to the database URL.
-        db_url = os.getenv("DATABASE_URL")
-        if db_url and 'sslmode' not in db_url:
-             db_url += "?sslmode=require"
-        g.db = psycopg2.connect(db_url)
+        g.db = get_pool().getconn()
     return g.db
 
 @app.teardown_appcontext
 def close_db(exception):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        # Anything left uncommitted is rolled back before the connection is reused.
+        get_pool().putconn(db, discard=isinstance(exception, psycopg2.OperationalError))
 
 # --- 4. HELPER FUNCTIONS & CONTEXT PROCESSORS ---
-def process_products(products_data):
-    processed = []
-    for product in products_data:
-        p = dict(product)
-        if p.get('original_price') is not None and p.get('discount_percent') is not None:
-            p['sale_price'] = float(p['original_price']) * (1 - p['discount_percent'] / 100.0)
-        processed.append(p)
-    return processed
+app.jinja_env.globals.update(product_image=images.product_image, product_image_url=images.image_url)
+
+@app.after_request
+def cache_fingerprinted_images(response):
+    # Variant file names change whenever their content does (build_images.py).
+    if request.path.startswith(images.VARIANTS_URL_PREFIX) and response.status_code == 200:
+        response.headers['Cache-Control'] = images.IMMUTABLE_CACHE_CONTROL
+    return response
+
+# The cart lives server side (cart_store.py) and the session cookie only
+# carries its id, so requests and responses stay the same size however big
+# the cart gets. It is loaded at most once per request.
+def get_cart():
+    if 'cart' not in g:
+        cart_id = session.get('cart_id')
+        if cart_id is None and current_user.is_authenticated:
+            # Signed in on a device that has no cart yet: use the one they
+            # may have filled elsewhere.
+            cart_id, g.cart = cart_store.store.find_user_cart(get_db(), current_user.id)
+            if cart_id is not None:
+                session['cart_id'] = cart_id
+        else:
+            g.cart = cart_store.store.load(get_db(), cart_id) if cart_id else {}
+    return g.cart
+
+def ensure_cart_id():
+    get_cart()
+    if session.get('cart_id') is None:
+        session['cart_id'] = cart_store.new_cart_id()
+    return session['cart_id']
+
+def save_cart(cart):
+    """Stores the cart and commits, together with any holds placed for it in this request."""
+    cart_id = ensure_cart_id()
+    db = get_db()
+    saved_id = cart_store.store.save(db, cart_id, cart, current_user.id if current_user.is_authenticated else None)
+    if saved_id != cart_id:
+        # Merged into the cart another device just created for this user;
+        # this cart's holds go with its lines.
+        cart = cart_store.store.load(db, saved_id)
+        cursor = db.cursor()
+        reservations.move_holds(cursor, cart_id, saved_id, cart)
+        cursor.close()
+        session['cart_id'] = saved_id
+    db.commit()
+    g.cart = cart
+
+def cart_item_count():
+    return sum(get_cart().values())
 
 @app.context_processor
 def inject_global_variables():
-    cart_items = session.get('cart', {})
-    item_count = sum(cart_items.values())
     # This ensures a 'product' object is always available, even if None, to prevent template errors.
-    return dict(cart_item_count=item_count, product=None)
+    return dict(cart_item_count=cart_item_count(), product=None)
 
 @app.template_filter('k_format')
 def k_format(num):
@@ -101,185 +164,170 @@ def k_format(num):
     return str(num)
 
 # --- 5. MAIN ROUTES ---
+# Catalog reads below come from the in-memory snapshot in catalog.py, which is
+# reloaded whenever Postgres NOTIFYs a product change. No DB round trip needed.
 @app.route('/')
 def home():
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    # NULLS LAST is a PostgreSQL feature to handle products that may not have ratings yet
-    cursor.execute("SELECT * FROM products ORDER BY rating DESC NULLS LAST, num_ratings DESC LIMIT 8")
-    featured_products_data = cursor.fetchall()
-    cursor.close()
-    
-    featured_products = process_products(featured_products_data)
-    hero_content = generate_content("hero_section")
-    trust_content = generate_content("trust_content")
-
-    return render_template(
-        'index.html',
-        hero=hero_content,
-        trust=trust_content,
-        products=featured_products
-    )
+    # The page only changes with the catalog (top rated products) and with the
+    # signed-in menu, so it is rendered once per catalog version and visitor
+    # type; flash messages and the cart badge are filled in per request.
+    catalog = get_catalog()
+    key = ('home', catalog.version, current_user.is_authenticated)
+    return page_cache.render_cached(key, cart_item_count(), 'index.html', lambda: dict(
+        hero=generate_content("hero_section"),
+        trust=generate_content("trust_content"),
+        # Already ordered by rating (unrated last), then number of ratings.
+        products=catalog.top_rated[:8]
+    ))
 
 @app.route('/collection/desert-wanderer')
 def desert_wanderer_collection():
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
+    catalog = get_catalog()
     collection_ids = [18, 24, 25, 31, 37]
-    placeholders = ','.join(['%s'] * len(collection_ids))
-    
-    cursor.execute(f"SELECT * FROM products WHERE id IN ({placeholders})", tuple(collection_ids))
-    collection_products_data = cursor.fetchall()
-    
-    cursor.execute("SELECT DISTINCT brand FROM products ORDER BY brand")
-    filter_brands_data = cursor.fetchall()
-    cursor.close()
-
-    products = process_products(collection_products_data)
-    filter_brands = [row['brand'] for row in filter_brands_data]
+    products = [catalog.by_id[pid] for pid in collection_ids if pid in catalog.by_id]
     
     return render_template(
         'products.html',
         products=products,
-        filter_brands=filter_brands,
+        filter_brands=catalog.brands,
+        facet_counts=get_facets().counts({}),
         collection_title="The Desert Wanderer Collection",
         active_filters={},
         search_query=None,
         sort_by='name_asc'
     )
 
-@app.route('/products')
-def product_listing():
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    category = request.args.get('category')
-    brand = request.args.get('brand')
-    search_query = request.args.get('q')
-    price_range = request.args.get('price')
-    rating = request.args.get('rating')
-    sort_by = request.args.get('sort', 'relevance')
-
-    # ILIKE is the case-insensitive version of LIKE in PostgreSQL
-    base_query = "SELECT *, (original_price * (1 - discount_percent / 100.0)) as sale_price FROM products"
-    params = []
-    conditions = []
-
+def listing_page(args):
+    """
+    Resolves the filters, search and sort in ``args`` into one keyset page of
+    products. Shared by the /products page and its infinite-scroll endpoint.
+    """
+    catalog = get_catalog()
+    search_query = args.get('q')
+    sort_by = args.get('sort', 'relevance')
+    active_filters = {'category': args.get('category'), 'brand': args.get('brand'), 'price': args.get('price'), 'rating': args.get('rating')}
+    page_size = clamp_page_size(args.get('per_page'), PRODUCTS_PER_PAGE, MAX_PRODUCTS_PER_PAGE)
+    cursor = decode_cursor(args.get('cursor'))
+    if not isinstance(cursor, dict):
+        cursor = {}
+
+    # Filters are set intersections over the precomputed facet index; a search
+    # query goes through the in-memory search index (prefixes, plurals, typos).
+    facet_index = get_facets()
+    search_ids = None
     if search_query:
-        conditions.append("name ILIKE %s")
-        params.append(f"%{search_query}%")
-
-    if category:
-        conditions.append("category = %s")
-        params.append(category)
-    if brand:
-        conditions.append("brand = %s")
-        params.append(brand)
-    if rating:
-        conditions.append("rating >= %s")
-        params.append(float(rating))
-    if price_range:
-        low, high = price_range.split('-')
-        conditions.append("(original_price * (1 - discount_percent / 100.0)) BETWEEN %s AND %s")
-        params.extend([int(low), int(high)])
-
-    if conditions:
-        base_query += " WHERE " + " AND ".join(conditions)
-
-    if sort_by == 'price_asc': base_query += " ORDER BY sale_price ASC"
-    elif sort_by == 'price_desc': base_query += " ORDER BY sale_price DESC"
-    elif sort_by == 'rating_desc': base_query += " ORDER BY rating DESC NULLS LAST"
-    else: base_query += " ORDER BY name ASC"
-
-    cursor.execute(base_query, tuple(params))
-    all_products_data = cursor.fetchall()
-    
-    cursor.execute("SELECT DISTINCT brand FROM products ORDER BY brand")
-    filter_brands_data = cursor.fetchall()
-    cursor.close()
-
-    filter_brands = [row['brand'] for row in filter_brands_data]
+        search_ids = [p['id'] for p in search_engine.search(search_query)]
+    matching_ids = facet_index.matching_ids(active_filters, search_ids)
+
+    if search_query and sort_by == 'relevance':
+        # Relevance order only exists as the (cached) ranked hit list, so this
+        # one mode pages by position in that list rather than by a sort key.
+        ranked = [pid for pid in search_ids if pid in matching_ids]
+        offset = max(cursor['o'], 0) if isinstance(cursor.get('o'), int) else 0
+        products = [catalog.by_id[pid] for pid in ranked[offset:offset + page_size]]
+        next_cursor = encode_cursor({'o': offset + page_size}) if offset + page_size < len(ranked) else None
+    else:
+        products, last_key = catalog.page(sort_by, None if matching_ids is facet_index.all_ids else matching_ids,
+                                          after=cursor.get('k'), limit=page_size)
+        next_cursor = encode_cursor({'k': last_key}) if last_key else None
+
+    return dict(
+        products=products,
+        next_cursor=next_cursor,
+        facet_index=facet_index,
+        active_filters=active_filters,
+        search_query=search_query,
+        search_ids=search_ids,
+        sort_by=sort_by,
+    )
 
+@app.route('/products')
+def product_listing():
+    page = listing_page(request.args)
     return render_template(
         'products.html', 
-        products=process_products(all_products_data),
-        filter_brands=filter_brands,
-        active_filters={'category': category, 'brand': brand, 'price': price_range, 'rating': rating},
-        search_query=search_query, 
-        sort_by=sort_by,
+        products=page['products'],
+        next_cursor=page['next_cursor'],
+        filter_brands=get_catalog().brands,
+        facet_counts=page['facet_index'].counts(page['active_filters'], page['search_ids'], page['search_query']),
+        active_filters=page['active_filters'],
+        search_query=page['search_query'], 
+        sort_by=page['sort_by'],
         collection_title=None
     )
 
+@app.route('/products/page')
+def product_listing_page():
+    """Infinite-scroll endpoint: the next page of product cards as an HTML fragment."""
+    page = listing_page(request.args)
+    html = render_template('_product_cards.html', products=page['products'])
+    return jsonify(html=html, next_cursor=page['next_cursor'], count=len(page['products']))
+
 @app.route('/product/<int:product_id>')
 def product_detail(product_id):
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
-    cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-    product_data = cursor.fetchone()
-    if not product_data:
-        cursor.close()
+    catalog = get_catalog()
+    product = catalog.get(product_id)
+    if not product:
         return "Product not found", 404
-    
-    product = process_products([product_data])[0]
-    
-    cursor.execute("SELECT id, size, stock_quantity FROM inventory WHERE product_id = %s ORDER BY size", (product_id,))
-    inventory = cursor.fetchall()
-
+    product_version = catalog.product_versions[product_id]
     sort_by = request.args.get('sort_reviews', 'newest')
-    order_clause = "ORDER BY r.review_date DESC"
-    if sort_by == 'oldest': order_clause = "ORDER BY r.review_date ASC"
-    elif sort_by == 'highest': order_clause = "ORDER BY r.rating DESC, r.review_date DESC"
-    elif sort_by == 'lowest': order_clause = "ORDER BY r.rating ASC, r.review_date DESC"
-
-    cursor.execute(f"""
-        SELECT r.rating, r.comment, u.username 
-        FROM reviews r JOIN users u ON r.user_id = u.id 
-        WHERE r.product_id = %s {order_clause} LIMIT %s
-    """, (product_id, REVIEWS_PER_PAGE))
-    reviews = cursor.fetchall()
-    
-    cursor.execute("SELECT * FROM products WHERE category = %s AND id != %s ORDER BY RANDOM() LIMIT 4", (product['category'], product_id))
-    recommended_products_data = cursor.fetchall()
-    
+
+    def inventory_context():
+        cursor = get_db().cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor.execute("SELECT id, size, stock_quantity, available_quantity FROM inventory WHERE product_id = %s ORDER BY size", (product_id,))
+        inventory = cursor.fetchall()
+        cursor.close()
+        return dict(product=product, inventory=inventory)
+
+    def reviews_context():
+        reviews, next_cursor = fetch_reviews(get_db(), product_id, sort_by, limit=REVIEWS_PER_PAGE)
+        return dict(product=product, reviews=reviews, next_reviews_cursor=next_cursor, sort_by=sort_by,
+                    rating_breakdown=fetch_rating_breakdown(get_db(), product_id))
+
+    # Everything but the cart and wishlist buttons is the same for every
+    # visitor, so it is rendered once per version of the data it shows.
+    recommended_products = recommendations.similar_products(product_id, limit=4)
+    fragments = dict(
+        gallery=render_fragment(('gallery', product_id, product_version), '_product_gallery.html',
+                                lambda: dict(product=product)),
+        summary=render_fragment(('summary', product_id, product_version, data_version('inventory', product_id)),
+                                '_product_summary.html', inventory_context),
+        reviews=render_fragment(('reviews', product_id, product_version, data_version('reviews', product_id), sort_by, request.host_url),
+                                '_product_reviews.html', reviews_context),
+        recommendations=render_fragment(('recommendations', tuple((p['id'], catalog.product_versions[p['id']]) for p in recommended_products)),
+                                        '_product_recommendations.html', lambda: dict(recommended_products=recommended_products)),
+    )
+
     is_in_wishlist = False
     if current_user.is_authenticated:
+        cursor = get_db().cursor(cursor_factory=psycopg2.extras.DictCursor)
         cursor.execute("SELECT id FROM wishlist WHERE user_id = %s AND product_id = %s", (current_user.id, product_id))
-        is_in_wishlist_data = cursor.fetchone()
-        if is_in_wishlist_data: is_in_wishlist = True
-    
-    cursor.close()
-    
-    recommended_products = process_products(recommended_products_data)
-    cart = session.get('cart', {})
+        is_in_wishlist = cursor.fetchone() is not None
+        cursor.close()
+    cart = get_cart()
     is_in_cart = any(key.startswith(f"{product_id}-") for key in cart.keys())
     
     return render_template(
         'product_detail.html', 
         product=product, 
-        inventory=inventory,
-        reviews=reviews,
+        fragments=fragments,
         is_in_cart=is_in_cart,
-        recommended_products=recommended_products,
-        request=request,
         is_in_wishlist=is_in_wishlist,
         sort_by=sort_by
     )
 
 @app.route('/quick_view/<int:product_id>')
 def quick_view(product_id):
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-    product_data = cursor.fetchone()
-    cursor.close()
-    
-    if not product_data:
+    catalog = get_catalog()
+    product = catalog.get(product_id)
+    if not product:
         return jsonify(error="Product not found"), 404
     
-    product = process_products([product_data])[0]
-    return render_template('quick_view_content.html', product=product)
+    key = ('quick_view', product_id, catalog.product_versions[product_id])
+    # The rating shown comes from the catalog, which only reloads on the
+    # NOTIFY; the reviews version moves as soon as a review is committed here.
+    return conditional_response(make_etag(*key, data_version('reviews', product_id)), 'catalog',
+                                lambda: render_fragment(key, 'quick_view_content.html', lambda: dict(product=product)))
 
 @app.route('/live_search')
 def live_search():
@@ -287,24 +335,17 @@ def live_search():
     if not query or len(query) < 2:
         return jsonify(products=[])
 
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    search_term = f"%{query}%"
-    cursor.execute("""
-        SELECT * FROM products 
-        WHERE name ILIKE %s OR brand ILIKE %s
-        ORDER BY num_ratings DESC, rating DESC NULLS LAST
-        LIMIT 5
-    """, (search_term, search_term))
-    products_data = cursor.fetchall()
-    cursor.close()
-    
-    products = process_products(products_data)
-    results = [
-        {"id": p['id'], "name": p['name'], "brand": p['brand'], "image_url": p['image_url'], "sale_price": f"₹{p['sale_price']:.0f}"}
-        for p in products
-    ]
-    return jsonify(products=results)
+    # Answered from the in-memory index; ranking blends relevance with popularity.
+    def build():
+        products = search_engine.search(query, limit=5)
+        results = [
+            {"id": p['id'], "name": p['name'], "brand": p['brand'], "image_url": p['image_url'],
+             "image_src": images.image_url(p['image_url'], 160), "sale_price": f"₹{p['sale_price']:.0f}"}
+            for p in products
+        ]
+        return jsonify(products=results)
+    # Results depend only on the catalog and the normalised query.
+    return conditional_response(make_etag('live_search', get_catalog().version, search_engine.query_tokens(query)), 'catalog', build)
 
 # --- 6. STATIC & INFO ROUTES ---
 @app.route('/about')
@@ -395,6 +436,18 @@ def login():
         user_from_db = db_get_user(username)
         if user_from_db and check_password_hash(user_from_db.password_hash, password):
             login_user(user_from_db)
+            # Whatever was put in the cart before signing in joins the user's own cart.
+            anonymous_cart_id = session.get('cart_id')
+            cart_id = cart_store.attach_to_user(get_db(), anonymous_cart_id, user_from_db.id)
+            if anonymous_cart_id is not None and cart_id != anonymous_cart_id:
+                cursor = get_db().cursor()
+                reservations.move_holds(cursor, anonymous_cart_id, cart_id, cart_store.store.load(get_db(), cart_id))
+                cursor.close()
+            get_db().commit()
+            if cart_id is None:
+                session.pop('cart_id', None)
+            else:
+                session['cart_id'] = cart_id
             next_page = request.args.get('next')
             return redirect(next_page or url_for('home'))
         else:
@@ -405,6 +458,8 @@ def login():
 @login_required
 def logout():
     logout_user()
+    # The cart stays with the account; this browser starts a fresh one.
+    session.pop('cart_id', None)
     return redirect(url_for('home'))
 
 # --- 8. USER ACCOUNT & ORDER ROUTES ---
@@ -488,151 +543,113 @@ def account_addresses():
 @app.route('/my-orders')
 @login_required
 def my_orders():
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT * FROM orders WHERE user_id = %s ORDER BY order_date DESC", (current_user.id,))
-    user_orders_data = cursor.fetchall()
-    
-    orders = []
-    for order_data in user_orders_data:
-        cursor.execute("""
-            SELECT p.name, oi.quantity, oi.price, oi.id as order_item_id, oi.has_reviewed
-            FROM order_items oi JOIN products p ON oi.product_id = p.id
-            WHERE oi.order_id = %s
-        """, (order_data['id'],))
-        items_data = cursor.fetchall()
-        orders.append({
-            'id': order_data['id'], 'date': order_data['order_date'], 'total': order_data['total_price'],
-            'status': order_data['status'], 'shipping_status': order_data['shipping_status'],
-            'order_products': [dict(row) for row in items_data]
-        })
-    cursor.close()
-    return render_template('my_orders.html', orders=orders)
+    page_size = clamp_page_size(request.args.get('per_page'), ORDERS_PER_PAGE, MAX_ORDERS_PER_PAGE)
+    orders, next_cursor = fetch_order_history(get_db(), current_user.id, request.args.get('cursor'), limit=page_size)
+    return render_template('my_orders.html', orders=orders, next_cursor=next_cursor, is_first_page=not request.args.get('cursor'))
 
 @app.route('/order/<int:order_id>')
 @login_required
 def order_details(order_id):
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT * FROM orders WHERE id = %s AND user_id = %s", (order_id, current_user.id))
-    order = cursor.fetchone()
+    order = fetch_order_details(get_db(), order_id, current_user.id)
     if not order:
-        cursor.close()
         flash("Order not found.", "error")
         return redirect(url_for('my_orders'))
-    cursor.execute("""
-        SELECT p.id as product_id, p.name, p.image_url, oi.quantity, oi.price as price_paid, oi.size
-        FROM order_items oi JOIN products p ON oi.product_id = p.id WHERE oi.order_id = %s
-    """, (order_id,))
-    order_items_data = cursor.fetchall()
-    cursor.execute("SELECT * FROM addresses WHERE id = %s", (order['shipping_address_id'],))
-    shipping_address = cursor.fetchone()
-    cursor.close()
-    order_items = [dict(row) for row in order_items_data]
+    order_items = order['order_items']
     subtotal = sum(float(item['price_paid']) * item['quantity'] for item in order_items)
     delivery_charge = 0 if subtotal >= FREE_SHIPPING_THRESHOLD else DELIVERY_CHARGE
-    return render_template('order_details.html', order=order, order_items=order_items, shipping_address=shipping_address, subtotal=subtotal, delivery_charge=delivery_charge, platform_fee=PLATFORM_FEE, order_date=order['order_date'])
+    return render_template('order_details.html', order=order, order_items=order_items, shipping_address=order['shipping_address'], subtotal=subtotal, delivery_charge=delivery_charge, platform_fee=PLATFORM_FEE, order_date=order['order_date'])
 
 # --- 9. CART & CHECKOUT ROUTES ---
 @app.route('/add_to_cart/<int:product_id>', methods=['POST'])
 def add_to_cart(product_id):
-    cart = session.get('cart', {})
-    quantity = int(request.form.get('quantity', 1))
-    inventory_id = request.form.get('inventory_id')
+    cart = dict(get_cart())
+    quantity = request.form.get('quantity', 1, type=int)
+    inventory_id = request.form.get('inventory_id', type=int)
+    if not quantity or quantity < 1:
+        flash('Invalid quantity.', 'error')
+        return redirect(url_for('product_detail', product_id=product_id))
     if not inventory_id:
         flash('Please select a size.', 'error')
         return redirect(url_for('product_detail', product_id=product_id))
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT * FROM inventory WHERE id = %s", (inventory_id,))
-    inventory_item = cursor.fetchone()
-    cursor.close()
-    if not inventory_item:
-        flash('Invalid product variant.', 'error')
-        return redirect(url_for('product_detail', product_id=product_id))
     cart_key = f"{product_id}-{inventory_id}"
     current_quantity = cart.get(cart_key, 0)
-    if (quantity + current_quantity) > inventory_item['stock_quantity']:
-        flash(f"Sorry, only {inventory_item['stock_quantity']} items are in stock for this size.", 'error')
+    # The units are held for this cart from now until checkout (or until the
+    # hold expires), so nobody finds them gone at the last step.
+    db = get_db()
+    cursor = db.cursor()
+    held, available = reservations.hold(cursor, ensure_cart_id(), product_id, inventory_id, current_quantity + quantity)
+    cursor.close()
+    if not held:
+        db.rollback()
+        if held is None:
+            flash('Invalid product variant.', 'error')
+        else:
+            flash(f"Sorry, only {available} items are in stock for this size.", 'error')
         return redirect(url_for('product_detail', product_id=product_id))
     cart[cart_key] = current_quantity + quantity
-    session['cart'] = cart
+    save_cart(cart)
     flash(f'Added {quantity} item(s) to your cart!', 'success')
     return redirect(url_for('product_detail', product_id=product_id))
 
 @app.route('/cart')
 def view_cart():
-    cart_items = session.get('cart', {})
-    if not cart_items:
-        return render_template('cart.html', cart_products=[], final_total_price=0, total_mrp=0, discount_on_mrp=0, platform_fee=0, delivery_charge=0)
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cart_products_display = []
-    total_sale_price = 0
-    total_mrp = 0
-    for cart_key, quantity in cart_items.items():
-        product_id, inventory_id = cart_key.split('-')
-        cursor.execute("SELECT p.*, i.size, i.id as inventory_id FROM products p JOIN inventory i ON p.id = i.product_id WHERE p.id = %s AND i.id = %s", (product_id, inventory_id))
-        item_data = cursor.fetchone()
-        if item_data:
-            processed_item = process_products([item_data])[0]
-            total_sale_price += processed_item['sale_price'] * quantity
-            total_mrp += float(item_data['original_price']) * quantity
-            processed_item.update({'quantity': quantity, 'subtotal': processed_item['sale_price'] * quantity, 'cart_key': cart_key})
-            cursor.execute("SELECT id, size, stock_quantity FROM inventory WHERE product_id = %s ORDER BY size", (product_id,))
-            processed_item['available_inventory'] = cursor.fetchall()
-            cart_products_display.append(processed_item)
-    cursor.close()
-    discount_on_mrp = total_mrp - total_sale_price
-    delivery_charge = 0 if total_sale_price >= FREE_SHIPPING_THRESHOLD else DELIVERY_CHARGE
-    final_total_price = total_sale_price + PLATFORM_FEE + delivery_charge
-    return render_template('cart.html', cart_products=cart_products_display, total_mrp=total_mrp, discount_on_mrp=discount_on_mrp, platform_fee=PLATFORM_FEE, delivery_charge=delivery_charge, final_total_price=final_total_price)
+    # Every line, with the sizes for its size picker, comes from one query.
+    cart = price_cart(get_db(), get_cart(), with_sizes=True, cart_id=session.get('cart_id'))
+    return render_template('cart.html', cart_products=cart.lines, **cart.totals())
 
 @app.route('/update_cart/<cart_key>', methods=['POST'])
 def update_cart(cart_key):
-    cart = session.get('cart', {})
+    cart = dict(get_cart())
     if cart_key in cart:
         try:
             quantity = int(request.form.get('quantity', 1))
             new_inventory_id = int(request.form.get('inventory_id'))
 
+            product_id, inventory_id = (int(part) for part in cart_key.split('-'))
+            db = get_db()
+            cursor = db.cursor()
+            cart_id = ensure_cart_id()
+
             # If quantity is set to 0 or less, it should be treated as a removal.
             if quantity <= 0:
+                reservations.hold(cursor, cart_id, product_id, inventory_id, 0)
                 cart.pop(cart_key, None)
                 flash('Item removed from cart.', 'success')
             else:
-                db = get_db()
-                cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-                cursor.execute("SELECT stock_quantity, product_id FROM inventory WHERE id = %s", (new_inventory_id,))
-                new_inventory_item = cursor.fetchone()
-                cursor.close()
-
-                if quantity > new_inventory_item['stock_quantity']:
-                    flash(f"Sorry, only {new_inventory_item['stock_quantity']} items are in stock.", 'error')
-                else:
-                    new_cart_key = f"{new_inventory_item['product_id']}-{new_inventory_id}"
+                # Give back the old size's units first, then hold the new ones,
+                # with both sizes locked in id order up front, as at checkout.
+                if new_inventory_id != inventory_id:
+                    reservations.lock_sizes(cursor, cart_id, [inventory_id, new_inventory_id])
+                    reservations.hold(cursor, cart_id, product_id, inventory_id, 0)
+                held, available = reservations.hold(cursor, cart_id, product_id, new_inventory_id, quantity)
+                if held:
+                    new_cart_key = f"{product_id}-{new_inventory_id}"
                     # Remove the old item regardless of whether the size changed
                     cart.pop(cart_key, None)
                     # Add the new or updated item
                     cart[new_cart_key] = quantity
                     flash('Cart updated.', 'success')
+                else:
+                    db.rollback()
+                    flash(f"Sorry, only {available} items are in stock." if held is False else 'Invalid update.', 'error')
+            cursor.close()
         except (ValueError, TypeError):
             flash('Invalid update.', 'error')
-    
-    session['cart'] = cart
-    session.modified = True # Ensure the session is saved
+        save_cart(cart)
     return redirect(url_for('view_cart'))
 
 @app.route('/remove_from_cart/<cart_key>', methods=['POST'])
 def remove_from_cart(cart_key):
-    cart = session.get('cart', {})
+    cart = dict(get_cart())
     
     # Use .pop() which safely removes a key and returns None if it's not found
     if cart.pop(cart_key, None):
+        product_id, inventory_id = (int(part) for part in cart_key.split('-'))
+        cursor = get_db().cursor()
+        reservations.hold(cursor, ensure_cart_id(), product_id, inventory_id, 0)
+        cursor.close()
+        save_cart(cart)
         flash('Item removed from your cart.', 'success')
-    
-    session['cart'] = cart
-    session.modified = True # Ensure the session is saved
     return redirect(url_for('view_cart'))
 
 @app.route('/checkout', methods=['GET', 'POST'])
@@ -640,30 +657,24 @@ def remove_from_cart(cart_key):
 def checkout():
     db = get_db()
     cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cart = session.get('cart', {})
+    if request.method == 'POST':
+        # A retried or double-clicked submission carries the key of the order
+        # it already placed: answer with that order and write nothing.
+        placed_order_id = find_order_by_key(cursor, current_user.id, request.form.get('idempotency_key'))
+        if placed_order_id is not None:
+            cursor.close()
+            flash(f'Your order has been placed successfully! Your Order ID is #{placed_order_id}.', 'success')
+            return redirect(url_for('checkout_success'))
+    cart = get_cart()
     if not cart:
         flash("Your cart is empty.", "info")
         return redirect(url_for('view_cart'))
     
-    total_sale_price = 0
-    total_mrp = 0
-    order_items_to_insert = []
-    cart_products_display = []
-    
-    for cart_key, quantity in cart.items():
-        product_id, inventory_id = cart_key.split('-')
-        cursor.execute("SELECT p.*, i.size, i.stock_quantity FROM products p JOIN inventory i ON p.id = i.product_id WHERE i.id = %s", (inventory_id,))
-        item_data = cursor.fetchone()
-        if item_data:
-            sale_price = float(item_data['original_price']) * (1 - item_data['discount_percent'] / 100.0)
-            total_sale_price += sale_price * quantity
-            total_mrp += float(item_data['original_price']) * quantity
-            cart_products_display.append({'name': item_data['name'], 'quantity': quantity, 'subtotal': sale_price * quantity, 'image_url': item_data['image_url'], 'size': item_data['size']})
-            order_items_to_insert.append({"product_id": product_id, "inventory_id": inventory_id, "size": item_data['size'], "quantity": quantity, "price": sale_price, "stock": item_data['stock_quantity']})
-
-    delivery_charge = 0 if total_sale_price >= FREE_SHIPPING_THRESHOLD else DELIVERY_CHARGE
-    final_total_price = total_sale_price + PLATFORM_FEE + delivery_charge
-    discount_on_mrp = total_mrp - total_sale_price
+    priced = price_cart(db, cart, cart_id=session.get('cart_id'))
+    if not priced.lines:
+        cursor.close()
+        flash("Your cart is empty.", "info")
+        return redirect(url_for('view_cart'))
 
     if request.method == 'POST':
         selected_address_id = request.form.get('selected_address')
@@ -671,32 +682,33 @@ def checkout():
             flash("Please select a shipping address.", "error")
             return redirect(url_for('checkout'))
         
-        for item in order_items_to_insert:
-            if item['quantity'] > item['stock']:
-                flash(f"An item in your cart is out of stock. Please review your cart.", "error")
-                return redirect(url_for('view_cart'))
+        if priced.out_of_stock():
+            flash(f"An item in your cart is out of stock. Please review your cart.", "error")
+            return redirect(url_for('view_cart'))
         
         payment_method = request.form.get('payment_method')
         payment_details = None
         if payment_method == 'card': payment_details = "4242"
         elif payment_method == 'upi': payment_details = request.form.get('upi_app', 'UPI').capitalize()
         
-        current_time = datetime.now()
-        tracking_number = f"AWB{random.randint(100000000, 999999999)}IN"
-        shipping_status = random.choice(['Processing', 'Shipped'])
-        
-        cursor.execute("INSERT INTO orders (user_id, shipping_address_id, payment_method, payment_details, order_date, total_price, tracking_number, shipping_status) VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id",
-                       (current_user.id, selected_address_id, payment_method, payment_details, current_time, final_total_price, tracking_number, shipping_status))
-        new_order_id = cursor.fetchone()['id']
-        
-        for item in order_items_to_insert:
-            cursor.execute("INSERT INTO order_items (order_id, product_id, inventory_id, size, quantity, price) VALUES (%s, %s, %s, %s, %s, %s)",
-                           (new_order_id, item['product_id'], item['inventory_id'], item['size'], item['quantity'], item['price']))
-            cursor.execute("UPDATE inventory SET stock_quantity = stock_quantity - %s WHERE id = %s",
-                           (item['quantity'], item['inventory_id']))
+        try:
+            new_order_id = place_order(cursor, current_user.id, selected_address_id, payment_method, payment_details, priced,
+                                       session['cart_id'], request.form.get('idempotency_key'))
+        except AlreadyPlaced as placed:
+            db.rollback()
+            cursor.close()
+            flash(f'Your order has been placed successfully! Your Order ID is #{placed.order_id}.', 'success')
+            return redirect(url_for('checkout_success'))
+        except OutOfStock:
+            db.rollback()
+            cursor.close()
+            flash("An item in your cart just sold out. Please review your cart.", "error")
+            return redirect(url_for('view_cart'))
+        # Emptied in the order's own transaction, so a placed order never leaves its cart behind.
+        cart_store.store.delete(db, session['cart_id'])
         db.commit()
         cursor.close()
-        session.pop('cart', None)
+        session.pop('cart_id', None)
         flash(f'Your order has been placed successfully! Your Order ID is #{new_order_id}.', 'success')
         return redirect(url_for('checkout_success'))
 
@@ -706,7 +718,8 @@ def checkout():
     addresses = cursor.fetchall()
     cursor.close()
     
-    return render_template('checkout.html', user=user_data, addresses=addresses, cart_products=cart_products_display, total_mrp=total_mrp, discount_on_mrp=discount_on_mrp, platform_fee=PLATFORM_FEE, delivery_charge=delivery_charge, final_total_price=final_total_price)
+    return render_template('checkout.html', user=user_data, addresses=addresses, cart_products=priced.lines,
+                           idempotency_key=new_idempotency_key(), **priced.totals())
 
 @app.route('/checkout/success')
 @login_required
@@ -719,10 +732,11 @@ def checkout_success():
 def wishlist():
     db = get_db()
     cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT p.* FROM products p JOIN wishlist w ON p.id = w.product_id WHERE w.user_id = %s", (current_user.id,))
-    wishlist_items_data = cursor.fetchall()
+    cursor.execute("SELECT product_id FROM wishlist WHERE user_id = %s", (current_user.id,))
+    wishlist_ids = [row['product_id'] for row in cursor.fetchall()]
     cursor.close()
-    wishlist_items = process_products(wishlist_items_data)
+    catalog = get_catalog()
+    wishlist_items = [catalog.by_id[pid] for pid in wishlist_ids if pid in catalog.by_id]
     return render_template('wishlist.html', products=wishlist_items)
 
 @app.route('/wishlist/add/<int:product_id>', methods=['POST'])
@@ -781,19 +795,24 @@ def submit_review(order_item_id):
         cursor.close()
         flash("Review submission failed. Item may already be reviewed.", "error")
         return redirect(url_for('my_orders'))
-    rating = request.form['rating']
+    rating = request.form.get('rating', type=int)
+    if rating not in (1, 2, 3, 4, 5):
+        cursor.close()
+        flash("Please choose a rating between 1 and 5 stars.", "error")
+        return redirect(url_for('leave_review', order_item_id=order_item_id))
     comment = request.form['comment']
     product_id = item['product_id']
     current_time = datetime.now()
     cursor.execute("INSERT INTO reviews (product_id, user_id, rating, comment, review_date) VALUES (%s, %s, %s, %s, %s)",
                    (product_id, current_user.id, rating, comment, current_time))
     cursor.execute("UPDATE order_items SET has_reviewed = TRUE WHERE id = %s", (order_item_id,))
-    cursor.execute("SELECT AVG(rating) as avg, COUNT(id) as count FROM reviews WHERE product_id = %s", (product_id,))
-    stats = cursor.fetchone()
-    if stats:
-        cursor.execute("UPDATE products SET rating = %s, num_ratings = %s WHERE id = %s", (stats['avg'], stats['count'], product_id))
+    record_rating(cursor, product_id, rating)
     db.commit()
     cursor.close()
+    # The products update NOTIFYs catalog_changed on commit, so every worker,
+    # this one included, reloads its catalog off the request path. The reviews
+    # version moves now, so this reviewer's next request can't get a stale 304.
+    touch_data_version('reviews', product_id)
     flash("Thank you for your review!", "success")
     return redirect(url_for('my_orders'))
 
@@ -801,16 +820,16 @@ def submit_review(order_item_id):
 @login_required
 def request_return(order_id):
     db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT * FROM orders WHERE id = %s AND user_id = %s", (order_id, current_user.id))
-    order = cursor.fetchone()
-    if order is None:
-        cursor.close()
-        flash("Order not found or access denied.", "error")
-        return redirect(url_for('my_orders'))
-    cursor.execute("UPDATE orders SET status = 'Return Requested' WHERE id = %s", (order_id,))
+    cursor = db.cursor()
+    found, changed = transition_order(cursor, order_id, current_user.id, 'request_return')
     db.commit()
     cursor.close()
+    if not found:
+        flash("Order not found or access denied.", "error")
+        return redirect(url_for('my_orders'))
+    if not changed:
+        flash("A return can't be requested for this order.", "error")
+        return redirect(url_for('order_details', order_id=order_id))
     flash(f"Return requested for Order #{order_id}. You will be contacted shortly.", "success")
     return redirect(url_for('my_orders'))
 
@@ -818,41 +837,31 @@ def request_return(order_id):
 @login_required
 def cancel_order(order_id):
     db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute("SELECT * FROM orders WHERE id = %s AND user_id = %s", (order_id, current_user.id))
-    order = cursor.fetchone()
-    if order is None:
-        cursor.close(); flash("Order not found.", "error"); return redirect(url_for('my_orders'))
-    if order['shipping_status'] == 'Delivered' or order['status'] == 'Cancelled':
-        cursor.close(); flash("This order cannot be cancelled.", "error"); return redirect(url_for('order_details', order_id=order_id))
-    cursor.execute("SELECT inventory_id, quantity FROM order_items WHERE order_id = %s", (order_id,))
-    order_items = cursor.fetchall()
-    for item in order_items:
-        cursor.execute("UPDATE inventory SET stock_quantity = stock_quantity + %s WHERE id = %s", (item['quantity'], item['inventory_id']))
-    cursor.execute("UPDATE orders SET status = 'Cancelled' WHERE id = %s", (order_id,))
+    cursor = db.cursor()
+    # Status change and restock are one statement: one round trip, and a
+    # second concurrent cancel finds the order already cancelled.
+    found, changed = transition_order(cursor, order_id, current_user.id, 'cancel')
     db.commit()
     cursor.close()
+    if not found:
+        flash("Order not found.", "error"); return redirect(url_for('my_orders'))
+    if not changed:
+        flash("This order cannot be cancelled.", "error"); return redirect(url_for('order_details', order_id=order_id))
     flash(f"Order #{order_id} has been cancelled.", "success")
     return redirect(url_for('my_orders'))
 
 @app.route('/get_reviews/<int:product_id>')
 def get_reviews(product_id):
-    page = request.args.get('page', 1, type=int)
     sort_by = request.args.get('sort', 'newest')
-    offset = (page - 1) * REVIEWS_PER_PAGE
-    order_clause = "ORDER BY r.review_date DESC"
-    if sort_by == 'oldest': order_clause = "ORDER BY r.review_date ASC"
-    elif sort_by == 'highest': order_clause = "ORDER BY r.rating DESC, r.review_date DESC"
-    elif sort_by == 'lowest': order_clause = "ORDER BY r.rating ASC, r.review_date DESC"
-    db = get_db()
-    cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute(f"""
-        SELECT r.rating, r.comment, u.username FROM reviews r JOIN users u ON r.user_id = u.id 
-        WHERE r.product_id = %s {order_clause} LIMIT %s OFFSET %s
-    """, (product_id, REVIEWS_PER_PAGE, offset))
-    reviews_data = cursor.fetchall()
-    cursor.close()
-    return jsonify(reviews=[dict(row) for row in reviews_data])
+    cursor_token = request.args.get('cursor')
+
+    def build():
+        reviews, next_cursor = fetch_reviews(get_db(), product_id, sort_by, cursor_token, limit=REVIEWS_PER_PAGE)
+        return jsonify(
+            reviews=[{'rating': r['rating'], 'comment': r['comment'], 'username': r['username']} for r in reviews],
+            next_cursor=next_cursor
+        )
+    return conditional_response(make_etag('reviews', product_id, data_version('reviews', product_id), sort_by, cursor_token), 'reviews', build)
 
 # --- 11. SOCKETIO CHATBOT ---
 @socketio.on('connect')
@@ -866,17 +875,12 @@ def handle_connect():
 @socketio.on('user_message')
 def handle_user_message(json):
     try:
-        # THE KEY FIX: Get the database URL inside the reliable Flask context.
-        db_url = os.getenv("DATABASE_URL")
-        if db_url and 'sslmode' not in db_url:
-            db_url += "?sslmode=require"
-
         user_query = json['data']
         chat_history = session.get('chat_history', [])
         user_id = current_user.id if current_user.is_authenticated else None
         
-        # Pass the known-good db_url to the RAG response function.
-        bot_reply = get_rag_response(user_query, chat_history, user_id, db_url)
+        # The chatbot borrows from the same process-wide pool as the routes.
+        bot_reply = get_rag_response(user_query, chat_history, user_id)
         
         chat_history.append({'role': 'user', 'content': user_query})
         chat_history.append({'role': 'assistant', 'content': bot_reply['text']})
@@ -889,5 +893,40 @@ def handle_user_message(json):
         socketio.emit('bot_response', {'data': error_reply})
     # --- END OF NEW ERROR HANDLING
 
+# --- 12. BOOT ---
+_warmed_up = False
+
+def warm_up():
+    """
+    Opens the pool's minimum connections, builds the in-memory catalog
+    indexes and starts the background loops, once per process. Called by the
+    server entry points (wsgi.py, python app.py), not on import, so scripts
+    and shells that import the app don't open connections or spawn loops.
+    """
+    global _warmed_up
+    if _warmed_up:
+        return
+    _warmed_up = True
+    started = time.perf_counter()
+    try:
+        opened = get_pool().warm()
+        warmed = time.perf_counter()
+        catalog = get_catalog()
+        loaded = time.perf_counter()
+        recommendations.similar_products(None)
+        print(f"[boot] app ready; {opened} database connection(s) in {1000 * (warmed - started):.0f} ms, "
+              f"{len(catalog)} products in {1000 * (loaded - warmed):.0f} ms, "
+              f"recommendations in {1000 * (time.perf_counter() - loaded):.0f} ms")
+    except psycopg2.Error as e:
+        print(f"[boot] database warm-up skipped: {e}")
+    # Keeps the catalog (and anything else subscribed) in sync with Postgres NOTIFYs.
+    socketio.start_background_task(change_feed.run_forever)
+    # Gives expired cart holds back to available stock.
+    socketio.start_background_task(reservations.run_sweeper)
+    # Runs the work requests queue (jobs.py) as soon as their transaction commits.
+    if os.getenv("JOBS_IN_PROCESS", "1") == "1":
+        socketio.start_background_task(jobs.run_dispatcher)
+
 if __name__ == '__main__':
+    warm_up()
     socketio.run(app)
\ No newline at end of file
@@ -0,0 +1,123 @@
+import sys
+import time
+import argparse
+import threading
+import psycopg2
+from dotenv import load_dotenv
+
+from db_pool import resolve_database_url
+from cart_pricing import price_cart
+from orders import place_order, OutOfStock
+
+# --- 1. SETUP ---
+def _pick_sku(cursor, inventory_id):
+    """The flash-sale SKU: the given inventory row, or the first one in stock."""
+    if inventory_id:
+        cursor.execute("SELECT id, product_id, stock_quantity FROM inventory WHERE id = %s", (inventory_id,))
+    else:
+        cursor.execute("SELECT id, product_id, stock_quantity FROM inventory WHERE stock_quantity > 0 ORDER BY id LIMIT 1")
+    return cursor.fetchone()
+
+def _pick_buyer(cursor):
+    cursor.execute("SELECT a.user_id, a.id FROM addresses a ORDER BY a.is_default DESC, a.id LIMIT 1")
+    return cursor.fetchone()
+
+# --- 2. WORKERS ---
+def _buyer(db_url, cart, quantity, user_id, address_id, deadline, results, lock):
+    conn = psycopg2.connect(db_url)
+    cursor = conn.cursor()
+    placed = failed = 0
+    latencies = []
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            priced = price_cart(conn, cart)
+            try:
+                order_id = place_order(cursor, user_id, address_id, 'card', '4242', priced)
+                conn.commit()
+                placed += 1
+                with lock:
+                    results['order_ids'].append(order_id)
+            except OutOfStock:
+                conn.rollback()
+                failed += 1
+                # Sold out for this buyer once what's left can't cover one order.
+                if priced.lines and priced.lines[0]['stock_quantity'] < quantity:
+                    break
+            latencies.append(time.perf_counter() - started)
+    finally:
+        cursor.close()
+        conn.close()
+    with lock:
+        results['placed'] += placed
+        results['sold_out'] += failed
+        results['latencies'] += latencies
+
+# --- 3. BENCHMARK ---
+def run(concurrency, seconds, stock, inventory_id=None, quantity=1):
+    """
+    Points ``concurrency`` buyers, each on its own connection, at one SKU with
+    ``stock`` units for ``seconds`` and reports orders/s, latency and whether
+    anything was oversold. Every order it places is deleted afterwards and
+    the SKU's stock is put back to what it was.
+    """
+    db_url = resolve_database_url()
+    conn = psycopg2.connect(db_url)
+    cursor = conn.cursor()
+    sku = _pick_sku(cursor, inventory_id)
+    buyer = _pick_buyer(cursor)
+    if sku is None or buyer is None:
+        print("Need a seeded database (python setup_database.py) to benchmark against.")
+        return 1
+    sku_id, product_id, original_stock = sku
+    cursor.execute("UPDATE inventory SET stock_quantity = %s WHERE id = %s", (stock, sku_id))
+    conn.commit()
+
+    cart = {f"{product_id}-{sku_id}": quantity}
+    results = {'placed': 0, 'sold_out': 0, 'latencies': [], 'order_ids': []}
+    lock = threading.Lock()
+    print(f"Flash sale on inventory #{sku_id}: {stock} units, {concurrency} concurrent buyers of {quantity}, {seconds}s...")
+    started = time.perf_counter()
+    deadline = started + seconds
+    threads = [threading.Thread(target=_buyer, args=(db_url, cart, quantity, buyer[0], buyer[1], deadline, results, lock)) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    cursor.execute("SELECT stock_quantity FROM inventory WHERE id = %s", (sku_id,))
+    final_stock = cursor.fetchone()[0]
+    latencies = sorted(results['latencies']) or [0]
+    units_sold = results['placed'] * quantity
+    print(f"  orders placed   {results['placed']} ({results['placed'] / elapsed:.1f}/s), {results['sold_out']} turned away as sold out")
+    print(f"  latency         p50 {1000 * latencies[len(latencies) // 2]:.1f} ms, p99 {1000 * latencies[int(len(latencies) * 0.99)]:.1f} ms")
+    print(f"  stock           {stock} -> {final_stock} ({units_sold} sold)")
+    oversold = final_stock < 0 or units_sold != stock - final_stock
+    print("  OVERSOLD" if oversold else "  no overselling")
+
+    # Leave the database as we found it.
+    # A one-SKU cart records no co-purchase pairs, so the orders and their
+    # follow-up jobs are all there is.
+    if results['order_ids']:
+        cursor.execute("DELETE FROM jobs WHERE kind = 'order_placed' AND (payload->>'order_id')::int = ANY(%s)", (results['order_ids'],))
+        cursor.execute("DELETE FROM orders WHERE id = ANY(%s)", (results['order_ids'],))
+    cursor.execute("UPDATE inventory SET stock_quantity = %s WHERE id = %s", (original_stock, sku_id))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return 1 if oversold else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark concurrent checkouts of a single flash-sale SKU.")
+    parser.add_argument("--concurrency", type=int, default=16, help="number of concurrent buyers (connections)")
+    parser.add_argument("--seconds", type=float, default=10, help="how long to run")
+    parser.add_argument("--stock", type=int, default=500, help="units put on sale")
+    parser.add_argument("--quantity", type=int, default=1, help="units per order")
+    parser.add_argument("--inventory-id", type=int, help="inventory row to sell (default: first in stock)")
+    args = parser.parse_args(argv)
+    load_dotenv()
+    return run(args.concurrency, args.seconds, args.stock, args.inventory_id, args.quantity)
+
+if __name__ == '__main__':
+    sys.exit(main())
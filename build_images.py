@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from io import BytesIO
+from PIL import Image, features
+
+# --- 1. SETTINGS ---
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'images', 'products')
+VARIANTS_DIRNAME = 'variants'
+MANIFEST_NAME = 'manifest.json'
+# Widths (px) generated for every image, never wider than the original.
+WIDTHS = [160, 320, 480, 640, 960, 1280]
+# Encoder settings per output format. AVIF is skipped when this Pillow build lacks it.
+FORMATS = {
+    'avif': {'quality': 50},
+    'webp': {'quality': 78, 'method': 6},
+}
+
+
+def _fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def _encode(image, fmt, options):
+    buffer = BytesIO()
+    image.save(buffer, format=fmt.upper(), **options)
+    return buffer.getvalue()
+
+
+def available_formats():
+    return [fmt for fmt in FORMATS if features.check(fmt)]
+
+
+def build_image(filename, formats, variants_dir):
+    """Writes every width/format variant of one source image; returns its manifest entry."""
+    path = os.path.join(SOURCE_DIR, filename)
+    with open(path, 'rb') as f:
+        source_hash = _fingerprint(f.read())
+    with Image.open(path) as original:
+        original.load()
+        image = original.convert('RGBA') if original.mode in ('P', 'LA') else original.copy()
+    entry = {'source': source_hash, 'width': image.width, 'height': image.height}
+
+    stem = os.path.splitext(filename)[0]
+    widths = [w for w in WIDTHS if w < image.width] + [min(image.width, WIDTHS[-1])]
+    for fmt in formats:
+        entry[fmt] = []
+        for width in sorted(set(widths)):
+            height = round(image.height * width / image.width)
+            data = _encode(image.resize((width, height), Image.LANCZOS), fmt, FORMATS[fmt])
+            name = f"{stem}-{width}.{_fingerprint(data)}.{fmt}"
+            target = os.path.join(variants_dir, name)
+            if not os.path.exists(target):
+                with open(target, 'wb') as f:
+                    f.write(data)
+            entry[fmt].append([width, f"{VARIANTS_DIRNAME}/{name}"])
+    return entry
+
+
+def build(force=False):
+    """
+    Generates resized, fingerprinted AVIF/WebP copies of every product image
+    and records them in variants/manifest.json, which images.py reads at
+    runtime. Images whose source bytes haven't changed are skipped unless
+    ``force`` is set.
+    """
+    started = time.perf_counter()
+    variants_dir = os.path.join(SOURCE_DIR, VARIANTS_DIRNAME)
+    os.makedirs(variants_dir, exist_ok=True)
+    manifest_path = os.path.join(variants_dir, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    formats = available_formats()
+    print(f"Building image variants ({', '.join(formats)}) at widths {WIDTHS}...")
+    sources = sorted(f for f in os.listdir(SOURCE_DIR) if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    built = 0
+    for filename in sources:
+        with open(os.path.join(SOURCE_DIR, filename), 'rb') as f:
+            source_hash = _fingerprint(f.read())
+        current = manifest.get(filename)
+        if current and current.get('source') == source_hash and all(fmt in current for fmt in formats):
+            continue
+        manifest[filename] = build_image(filename, formats, variants_dir)
+        built += 1
+
+    # Drop entries for images that no longer exist and formats this Pillow
+    # build can no longer produce (images.py would keep serving them), then
+    # any file nothing refers to.
+    manifest = {name: {key: value for key, value in entry.items() if key not in FORMATS or key in formats}
+                for name, entry in manifest.items() if name in sources}
+    referenced = {path.split('/', 1)[1] for entry in manifest.values() for fmt in formats for _, path in entry.get(fmt, [])}
+    for name in os.listdir(variants_dir):
+        if name != MANIFEST_NAME and name not in referenced:
+            os.remove(os.path.join(variants_dir, name))
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    print(f"Image variants ready: {built} of {len(sources)} images rebuilt in {time.perf_counter() - started:.1f}s.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build responsive image variants for static/images/products.")
+    parser.add_argument('--force', action='store_true', help="rebuild every image, ignoring the existing manifest")
+    args = parser.parse_args(argv)
+    build(force=args.force)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+from decimal import Decimal
+import psycopg2.extras
+
+# --- 1. PRICING RULES ---
+PLATFORM_FEE = Decimal(20)
+FREE_SHIPPING_THRESHOLD = Decimal(1499)
+DELIVERY_CHARGE = Decimal(50)
+
+
+def parse_cart(cart):
+    """
+    Splits the session cart ({"<product_id>-<inventory_id>": quantity}) into
+    (cart_key, product_id, inventory_id, quantity) tuples, skipping any key or
+    quantity that isn't well formed instead of failing the whole cart.
+    """
+    entries = []
+    for cart_key, quantity in cart.items():
+        try:
+            product_id, inventory_id = (int(part) for part in cart_key.split('-'))
+            quantity = int(quantity)
+        except (AttributeError, TypeError, ValueError):
+            continue
+        if quantity > 0:
+            entries.append((cart_key, product_id, inventory_id, quantity))
+    return entries
+
+
+class PricedCart:
+    """Priced cart lines plus the order totals, all in Decimal rupees."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.total_sale_price = sum((line['subtotal'] for line in lines), Decimal(0))
+        self.total_mrp = sum((line['original_price'] * line['quantity'] for line in lines), Decimal(0))
+        self.discount_on_mrp = self.total_mrp - self.total_sale_price
+        self.platform_fee = PLATFORM_FEE if lines else Decimal(0)
+        self.delivery_charge = Decimal(0) if not lines or self.total_sale_price >= FREE_SHIPPING_THRESHOLD else DELIVERY_CHARGE
+        self.final_total_price = self.total_sale_price + self.platform_fee + self.delivery_charge
+
+    def totals(self):
+        """The totals as the keyword arguments cart.html and checkout.html expect."""
+        return dict(total_mrp=self.total_mrp, discount_on_mrp=self.discount_on_mrp, platform_fee=self.platform_fee,
+                    delivery_charge=self.delivery_charge, final_total_price=self.final_total_price)
+
+    def out_of_stock(self):
+        """
+        Lines asking for more than is available to this cart: the unreserved
+        stock read with them plus the cart's own hold, as decrement_stock checks.
+        """
+        return [line for line in self.lines if line['quantity'] > line['available_quantity'] + line['held_quantity']]
+
+
+def price_cart(conn, cart, with_sizes=False, cart_id=None):
+    """
+    Prices the whole cart with one query, however many lines it has. Each
+    line is the product row plus inventory_id, size, stock_quantity,
+    available_quantity, held_quantity (what ``cart_id`` itself holds of the
+    size), quantity, subtotal and cart_key, in cart order. With
+    ``with_sizes`` every line also carries available_inventory (all sizes of
+    the product with their unreserved stock), which the cart page's size
+    picker needs. Lines whose product or size no longer exists are dropped.
+    """
+    entries = parse_cart(cart)
+    if not entries:
+        return PricedCart([])
+
+    sizes_column = ""
+    if with_sizes:
+        sizes_column = """, (SELECT json_agg(json_build_object('id', s.id, 'size', s.size, 'available_quantity', s.available_quantity) ORDER BY s.size)
+                             FROM inventory s WHERE s.product_id = p.id) AS available_inventory"""
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute(f"""
+        SELECT p.*, i.id AS inventory_id, i.size, i.stock_quantity, i.available_quantity,
+               COALESCE(h.quantity, 0) AS held_quantity{sizes_column}
+        FROM inventory i JOIN products p ON p.id = i.product_id
+        LEFT JOIN inventory_holds h ON h.inventory_id = i.id AND h.cart_id = %s
+        WHERE i.id = ANY(%s)
+    """, (cart_id, [inventory_id for _, _, inventory_id, _ in entries]))
+    rows = {row['inventory_id']: row for row in cursor.fetchall()}
+    cursor.close()
+
+    lines = []
+    for cart_key, product_id, inventory_id, quantity in entries:
+        row = rows.get(inventory_id)
+        if row is None or row['id'] != product_id:
+            continue
+        line = dict(row)
+        line.update(quantity=quantity, subtotal=row['sale_price'] * quantity, cart_key=cart_key)
+        lines.append(line)
+    return PricedCart(lines)
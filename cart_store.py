@@ -0,0 +1,165 @@
+import os
+import uuid
+import threading
+
+# --- 1. CONFIGURATION ---
+# 'postgres' (the carts table, shared by every worker and device) or 'memory'
+# (this process only; handy for local development without a database).
+CART_BACKEND = os.getenv("CART_BACKEND", "postgres")
+# Upper bound for one line after two carts are merged at login.
+MAX_LINE_QUANTITY = 10
+
+
+# --- 2. ENCODING ---
+# A cart is stored as one short string, "<product_id>-<inventory_id>:<qty>"
+# joined by commas, e.g. "12-57:1,3-14:2": a few bytes per line instead of a
+# JSON document, and the cookie only ever carries the cart id.
+def encode_items(items):
+    return ",".join(f"{key}:{quantity}" for key, quantity in items.items() if quantity > 0)
+
+
+def decode_items(text):
+    items = {}
+    for part in (text or "").split(","):
+        key, _, quantity = part.partition(":")
+        try:
+            quantity = int(quantity)
+        except ValueError:
+            continue
+        if key and quantity > 0:
+            items[key] = quantity
+    return items
+
+
+def merge_items(into, other):
+    """Adds ``other``'s lines to ``into`` (a new dict), capping each line at MAX_LINE_QUANTITY."""
+    merged = dict(into)
+    for key, quantity in other.items():
+        merged[key] = min(merged.get(key, 0) + quantity, MAX_LINE_QUANTITY)
+    return merged
+
+
+def new_cart_id():
+    return uuid.uuid4().hex
+
+
+# --- 3. BACKENDS ---
+# Both take the request's connection so callers don't care which one is in
+# use. Writes join the caller's transaction; the caller commits.
+class PostgresCartStore:
+    """Carts in the carts table (migration 9), one row per cart."""
+
+    def load(self, conn, cart_id):
+        cursor = conn.cursor()
+        cursor.execute("SELECT items FROM carts WHERE id = %s", (cart_id,))
+        row = cursor.fetchone()
+        cursor.close()
+        return decode_items(row[0]) if row else {}
+
+    def find_user_cart(self, conn, user_id):
+        """(cart_id, items) of the user's cart, or (None, {})."""
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, items FROM carts WHERE user_id = %s", (user_id,))
+        row = cursor.fetchone()
+        cursor.close()
+        return (row[0], decode_items(row[1])) if row else (None, {})
+
+    def save(self, conn, cart_id, items, user_id=None):
+        """
+        Writes the cart and returns the id it was stored under. That is
+        ``cart_id`` unless a signed-in user's new cart lost a race with one
+        created for them elsewhere (carts.user_id is unique): the lines are
+        then merged into that cart and its id is returned.
+        """
+        cursor = conn.cursor()
+        try:
+            cursor.execute("UPDATE carts SET items = %s, updated_at = NOW() WHERE id = %s", (encode_items(items), cart_id))
+            if cursor.rowcount:
+                return cart_id
+            cursor.execute("INSERT INTO carts (id, user_id, items, updated_at) VALUES (%s, %s, %s, NOW()) ON CONFLICT DO NOTHING",
+                           (cart_id, user_id, encode_items(items)))
+            if cursor.rowcount:
+                return cart_id
+            # A concurrent request committed this cart id, or the user's cart,
+            # first; this statement sees its row.
+            cursor.execute("""
+                SELECT id, items FROM carts WHERE id = %s OR user_id = %s
+                ORDER BY id = %s DESC LIMIT 1 FOR UPDATE
+            """, (cart_id, user_id, cart_id))
+            existing_id, existing_items = cursor.fetchone()
+            if existing_id != cart_id:
+                items = merge_items(decode_items(existing_items), items)
+            cursor.execute("UPDATE carts SET items = %s, updated_at = NOW() WHERE id = %s", (encode_items(items), existing_id))
+            return existing_id
+        finally:
+            cursor.close()
+
+    def claim(self, conn, cart_id, user_id):
+        """Makes an anonymous cart the user's own."""
+        cursor = conn.cursor()
+        cursor.execute("UPDATE carts SET user_id = %s, updated_at = NOW() WHERE id = %s AND user_id IS NULL", (user_id, cart_id))
+        cursor.close()
+
+    def delete(self, conn, cart_id):
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM carts WHERE id = %s", (cart_id,))
+        cursor.close()
+
+
+class MemoryCartStore:
+    """Carts in a dict; lost on restart and not shared between workers."""
+
+    def __init__(self):
+        self._carts = {}
+        self._lock = threading.Lock()
+
+    def load(self, conn, cart_id):
+        with self._lock:
+            cart = self._carts.get(cart_id)
+        return decode_items(cart[1]) if cart else {}
+
+    def find_user_cart(self, conn, user_id):
+        with self._lock:
+            for cart_id, (owner, text) in self._carts.items():
+                if owner == user_id:
+                    return cart_id, decode_items(text)
+        return None, {}
+
+    def save(self, conn, cart_id, items, user_id=None):
+        with self._lock:
+            owner = self._carts.get(cart_id, (user_id, ""))[0]
+            self._carts[cart_id] = (owner, encode_items(items))
+        return cart_id
+
+    def claim(self, conn, cart_id, user_id):
+        with self._lock:
+            if cart_id in self._carts and self._carts[cart_id][0] is None:
+                self._carts[cart_id] = (user_id, self._carts[cart_id][1])
+
+    def delete(self, conn, cart_id):
+        with self._lock:
+            self._carts.pop(cart_id, None)
+
+
+store = MemoryCartStore() if CART_BACKEND == "memory" else PostgresCartStore()
+
+
+# --- 4. LOGIN MERGE ---
+def attach_to_user(conn, cart_id, user_id):
+    """
+    Called on login with the visitor's anonymous cart id (or None). Returns
+    the id of the cart the user should now use: their existing cart with the
+    anonymous lines merged in, or the anonymous cart itself, claimed, when
+    they had none. The caller commits.
+    """
+    user_cart_id, user_items = store.find_user_cart(conn, user_id)
+    if cart_id is None or cart_id == user_cart_id:
+        return user_cart_id
+    anonymous_items = store.load(conn, cart_id)
+    if user_cart_id is None:
+        store.claim(conn, cart_id, user_id)
+        return cart_id
+    if anonymous_items:
+        store.save(conn, user_cart_id, merge_items(user_items, anonymous_items), user_id)
+    store.delete(conn, cart_id)
+    return user_cart_id
@@ -0,0 +1,170 @@
+import hashlib
+import threading
+from bisect import bisect_right
+from types import MappingProxyType
+import psycopg2.extras
+
+from db_pool import get_pool
+from change_feed import feed
+
+# Channel our products trigger (migration 3) notifies on.
+CATALOG_CHANNEL = "catalog_changed"
+
+# Sort modes understood by CatalogSnapshot.sorted(); 'name_asc' is the default.
+# Every key ends with the product id so it is unique, which is what lets a page
+# resume strictly after the last key it showed (keyset pagination). Keys only
+# hold JSON-friendly values so they can travel inside a cursor.
+SORT_KEYS = {
+    'name_asc': lambda p: (p['name'], p['id']),
+    'price_asc': lambda p: (p['sale_price'], p['id']),
+    'price_desc': lambda p: (-p['sale_price'], p['id']),
+    'rating_desc': lambda p: (p['rating'] is None, -float(p['rating'] or 0), p['id']),
+}
+# When a filter keeps fewer than 1/N of the catalog, sorting the matches beats
+# walking the presorted list past all the products the filter rejects.
+SPARSE_FILTER_RATIO = 8
+
+
+def _freeze(row):
+    """Turns a products row into a read-only mapping; sale_price becomes a float so sort keys fit in a cursor."""
+    p = dict(row)
+    p['sale_price'] = float(p['sale_price'])
+    return MappingProxyType(p)
+
+
+def _digest(values):
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()[:12]
+
+
+class CatalogSnapshot:
+    """
+    An immutable, fully indexed copy of the products table.
+
+    Every lookup is a dictionary or tuple access; nothing here touches the
+    database. A new snapshot is built off to the side and swapped in with a
+    single reference assignment, so readers always see a consistent catalog.
+    ``version`` is a content hash, identical in every worker process that has
+    loaded the same data, and therefore safe to use in cache keys and ETags.
+    """
+
+    def __init__(self, rows):
+        products = tuple(_freeze(row) for row in sorted(rows, key=lambda r: r['id']))
+        self.products = products
+        self.by_id = MappingProxyType({p['id']: p for p in products})
+        by_category, by_brand = {}, {}
+        for p in products:
+            by_category.setdefault(p['category'], []).append(p)
+            by_brand.setdefault(p['brand'], []).append(p)
+        self.by_category = MappingProxyType({k: tuple(v) for k, v in by_category.items()})
+        self.by_brand = MappingProxyType({k: tuple(v) for k, v in by_brand.items()})
+        self.brands = tuple(sorted(b for b in by_brand if b is not None))
+        self._sorted = {mode: tuple(sorted(products, key=key)) for mode, key in SORT_KEYS.items()}
+        self._sort_keys = {mode: [SORT_KEYS[mode](p) for p in ordering] for mode, ordering in self._sorted.items()}
+        self.top_rated = tuple(sorted(products, key=lambda p: (p['rating'] is None, -(p['rating'] or 0), -p['num_ratings'], p['id'])))
+        self.product_versions = MappingProxyType({p['id']: _digest(sorted(p.items())) for p in products})
+        self.version = _digest(sorted(self.product_versions.items()))
+
+    def get(self, product_id):
+        return self.by_id.get(product_id)
+
+    def sorted(self, sort_by):
+        """All products in the requested order; unknown modes fall back to name."""
+        return self._sorted.get(sort_by, self._sorted['name_asc'])
+
+    def page(self, sort_by, matching_ids=None, after=None, limit=24):
+        """
+        One keyset page: up to ``limit`` products in ``sort_by`` order whose sort
+        key comes strictly after ``after`` and whose id is in ``matching_ids``
+        (None means every product). Returns (products, key of the last product
+        or None when there is nothing further). Cost depends on the page size,
+        not on how deep into the catalog the page is.
+        """
+        mode = sort_by if sort_by in SORT_KEYS else 'name_asc'
+        key_fn = SORT_KEYS[mode]
+
+        if matching_ids is not None and len(matching_ids) * SPARSE_FILTER_RATIO < len(self.products):
+            ordering = sorted((self.by_id[i] for i in matching_ids if i in self.by_id), key=key_fn)
+            keys = [key_fn(p) for p in ordering]
+            matching_ids = None
+        else:
+            ordering, keys = self._sorted[mode], self._sort_keys[mode]
+
+        start = 0
+        if after and isinstance(after, list):
+            try:
+                start = bisect_right(keys, tuple(after))
+            except TypeError:
+                pass  # A cursor from a different sort mode; start over.
+
+        items = []
+        for i in range(start, len(ordering)):
+            p = ordering[i]
+            if matching_ids is None or p['id'] in matching_ids:
+                items.append(p)
+                if len(items) > limit:
+                    break
+        if len(items) > limit:
+            return items[:limit], list(key_fn(items[limit - 1]))
+        return items, None
+
+    def __len__(self):
+        return len(self.products)
+
+
+# --- PROCESS-WIDE SNAPSHOT ---
+_snapshot = None
+_reload_lock = threading.Lock()
+# Callables invoked with (old_snapshot, new_snapshot) after every swap, so derived
+# in-memory structures (search index, facets, ...) can update incrementally.
+_refresh_listeners = []
+
+
+def on_refresh(callback):
+    _refresh_listeners.append(callback)
+    return callback
+
+
+def load_snapshot(conn):
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    cursor.execute("SELECT * FROM products")
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.rollback()
+    return CatalogSnapshot(rows)
+
+
+def refresh():
+    """Reloads the catalog from Postgres and atomically swaps it in."""
+    global _snapshot
+    with _reload_lock:
+        with get_pool().connection() as conn:
+            new_snapshot = load_snapshot(conn)
+        old_snapshot = _snapshot
+        changed = old_snapshot is None or old_snapshot.version != new_snapshot.version
+        _snapshot = new_snapshot
+        if changed:
+            for callback in _refresh_listeners:
+                try:
+                    callback(old_snapshot, new_snapshot)
+                except Exception as e:
+                    print(f"--- CATALOG: refresh listener failed: {e} ---")
+    if changed:
+        print(f"Catalog snapshot loaded: {len(new_snapshot)} products (version {new_snapshot.version}).")
+    return new_snapshot
+
+
+def get_catalog():
+    """Returns the current snapshot, loading it on first use."""
+    snapshot = _snapshot
+    if snapshot is None:
+        snapshot = refresh()
+    return snapshot
+
+
+def _on_catalog_changed(payloads):
+    # Whatever changed (or None after a reconnect), the table is small enough
+    # that one full reload per notification batch is the simplest correct answer.
+    refresh()
+
+
+feed.subscribe(CATALOG_CHANNEL, _on_catalog_changed)
@@ -0,0 +1,91 @@
+import time
+import select
+from collections import defaultdict
+import psycopg2
+import psycopg2.extensions
+
+from db_pool import resolve_database_url
+
+# How long (seconds) a single wait on the socket lasts before we loop again.
+POLL_INTERVAL = 5.0
+# Reconnect back-off bounds (seconds) when the listening connection drops.
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 30.0
+
+
+class ChangeFeed:
+    """
+    Listens for Postgres NOTIFY messages on a dedicated connection and hands them
+    to in-process subscribers.
+
+    Notifications that arrive together are grouped per channel, so a bulk update
+    of 500 products costs one callback with 500 payloads rather than 500
+    callbacks. Subscribers are called with ``payloads=None`` after every
+    (re)connect: notifications sent while we were not listening are lost, so
+    each subscriber must resynchronise from scratch.
+
+    ``run_forever`` blocks; start it with ``socketio.start_background_task`` so
+    it runs as a green thread under eventlet (where ``select`` is patched).
+    """
+
+    def __init__(self, dsn=None):
+        self.dsn = dsn
+        self._subscribers = defaultdict(list)
+        self._running = False
+
+    def subscribe(self, channel, callback):
+        self._subscribers[channel].append(callback)
+
+    def _dispatch(self, channel, payloads):
+        for callback in self._subscribers.get(channel, []):
+            try:
+                callback(payloads)
+            except Exception as e:
+                print(f"--- CHANGE FEED: subscriber for '{channel}' failed: {e} ---")
+
+    def _listen(self):
+        conn = psycopg2.connect(self.dsn or resolve_database_url())
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        cursor = conn.cursor()
+        for channel in self._subscribers:
+            cursor.execute(f"LISTEN {channel};")
+        cursor.close()
+        return conn
+
+    def run_forever(self):
+        self._running = True
+        delay = RECONNECT_MIN_DELAY
+        while self._running:
+            conn = None
+            try:
+                conn = self._listen()
+                delay = RECONNECT_MIN_DELAY
+                for channel in list(self._subscribers):
+                    self._dispatch(channel, None)
+                while self._running:
+                    if select.select([conn], [], [], POLL_INTERVAL) == ([], [], []):
+                        continue
+                    conn.poll()
+                    batch = defaultdict(list)
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        batch[notify.channel].append(notify.payload)
+                    for channel, payloads in batch.items():
+                        self._dispatch(channel, payloads)
+            except (psycopg2.Error, OSError) as e:
+                print(f"--- CHANGE FEED: connection lost ({e}); retrying in {delay:.0f}s ---")
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def stop(self):
+        self._running = False
+
+
+# One feed per process; modules subscribe to it at import time.
+feed = ChangeFeed()
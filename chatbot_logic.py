@@ -7,6 +7,10 @@ import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import psycopg2
 import psycopg2.extras
+from db_pool import get_pool
+import search_engine
+import recommendations
+from images import image_url
 
 # --- 1. SETUP (Unchanged) ---
 load_dotenv()
@@ -23,28 +27,28 @@ safety_settings = {
 model = genai.GenerativeModel('gemini-1.5-flash-latest', safety_settings=safety_settings)
 
 # --- 2. DATABASE TOOLS (Completely Rewritten for Robustness) ---
-def get_db_connection(db_url):
-    """Establishes a secure connection to the PostgreSQL database."""
-    conn = psycopg2.connect(db_url)
-    return conn
-
-def find_bestsellers(db_url):
-    conn = get_db_connection(db_url)
+# Every tool receives an already checked-out connection, so one chat message
+# costs at most one pool checkout no matter which tool answers it.
+def borrow_connection():
+    """
+    Context manager that borrows a connection from the shared application
+    pool (see db_pool.py) and returns it on exit: ``with borrow_connection() as conn``.
+    """
+    return get_pool().connection()
+
+def find_bestsellers(conn):
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     cursor.execute("SELECT * FROM products WHERE num_ratings > 0 ORDER BY rating DESC, num_ratings DESC LIMIT 3")
     bestsellers = cursor.fetchall()
     cursor.close()
-    conn.close()
     return [dict(row) for row in bestsellers]
 
-def find_reviews_for_product(db_url, search_term):
-    conn = get_db_connection(db_url)
+def find_reviews_for_product(conn, search_term):
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     clean_search = re.sub(r'reviews for|people say about|thoughts on', '', search_term, flags=re.IGNORECASE).strip()
     words = [word for word in clean_search.split() if word.lower() not in {'the', 'a', 'an'}]
     if not words:
         cursor.close()
-        conn.close()
         return []
     
     conditions = " AND ".join(["p.name ILIKE %s"] * len(words))
@@ -54,11 +58,9 @@ def find_reviews_for_product(db_url, search_term):
     cursor.execute(query, tuple(params))
     reviews = cursor.fetchall()
     cursor.close()
-    conn.close()
     return [dict(row) for row in reviews]
 
-def find_relevant_products(db_url, search_term):
-    conn = get_db_connection(db_url)
+def find_relevant_products(conn, search_term):
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     
     query_lower = search_term.lower()
@@ -71,9 +73,8 @@ def find_relevant_products(db_url, search_term):
         if any(word in query_lower for word in ['above', 'over', 'more than']):
             operator = ">"
         
-        # This is the sale price calculation
-        price_formula = "(original_price * (1 - discount_percent / 100.0))"
-        query = f"SELECT * FROM products WHERE {price_formula} {operator} %s ORDER BY {price_formula} DESC LIMIT 3"
+        # sale_price is a stored, indexed column, so this is an index range scan.
+        query = f"SELECT * FROM products WHERE sale_price {operator} %s ORDER BY sale_price DESC LIMIT 3"
         cursor.execute(query, (price_limit,))
     else:
         # If not a price query, perform a text search
@@ -83,7 +84,6 @@ def find_relevant_products(db_url, search_term):
         
         if not words:
             cursor.close()
-            conn.close()
             return []
             
         conditions = " AND ".join(["(name ILIKE %s OR brand ILIKE %s OR category ILIKE %s)"] * len(words))
@@ -94,13 +94,11 @@ def find_relevant_products(db_url, search_term):
 
     products = cursor.fetchall()
     cursor.close()
-    conn.close()
     return [dict(row) for row in products]
 
-def get_user_order_history(db_url, user_id):
+def get_user_order_history(conn, user_id):
     if user_id is None:
         return {"text": "Please log in to see your order history."}
-    conn = get_db_connection(db_url)
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
     cursor.execute("""
         SELECT o.id, o.order_date, p.image_url, p.name 
@@ -112,11 +110,21 @@ def get_user_order_history(db_url, user_id):
     """, (user_id,))
     orders = cursor.fetchall()
     cursor.close()
-    conn.close()
     if not orders:
         return {"text": "You have no past orders."}
     return {"text": "Here is your recent order history:", "orders": [dict(row) for row in orders]}
 
+# Served from the in-memory search and recommendation indexes; no connection needed.
+SIMILAR_TRIGGER_WORDS = {'similar', 'like', 'goes', 'go', 'with', 'pair', 'match', 'recommend', 'suggest', 'something', 'anything',
+                         'items', 'products', 'other', 'to', 'me', 'show', 'what', 'would', 'can', 'could', 'you', 'i', 'my', 'this', 'that', 'well', 'some', 'any'}
+
+def find_similar_products(search_term):
+    words = [w for w in re.findall(r'\b\w+\b', search_term.lower()) if w not in SIMILAR_TRIGGER_WORDS]
+    anchor = search_engine.search(" ".join(words), limit=1)
+    if not anchor:
+        return None, []
+    return anchor[0], recommendations.similar_products(anchor[0]['id'], limit=3)
+
 # --- 3. INTENT CLASSIFICATION (Unchanged but still essential) ---
 def _get_user_intent(query):
     query_lower = query.lower()
@@ -130,36 +138,66 @@ def _get_user_intent(query):
         return 'get_order_history'
     if 'return policy' in query_lower:
         return 'get_return_policy'
+    if query_words & {'similar', 'recommend', 'suggest', 'pair', 'match'} or 'goes with' in query_lower:
+        return 'find_similar'
     if any(word in query_words for word in ["hello", "hi", "hey"]):
         return 'greeting'
     
     return 'find_product'
 
 # --- 4. RAG LOGIC (Updated to use the new tools and AI prompt) ---
-def get_rag_response(user_query, chat_history, user_id, db_url):
+def _run_db_tool(conn, intent, user_query, user_id):
+    """Runs the single database tool an intent needs on an already borrowed connection."""
+    if intent == 'find_bestsellers':
+        return find_bestsellers(conn)
+    if intent == 'find_reviews':
+        return find_reviews_for_product(conn, user_query)
+    if intent == 'get_order_history':
+        return get_user_order_history(conn, user_id)
+    if intent == 'find_product':
+        return find_relevant_products(conn, user_query)
+    return None
+
+# Intents answered without touching the database never borrow a connection.
+DB_INTENTS = {'find_bestsellers', 'find_reviews', 'get_order_history', 'find_product'}
+
+def get_rag_response(user_query, chat_history, user_id):
     response_payload = {"text": "", "products": [], "orders": []}
     intent = _get_user_intent(user_query)
 
+    # The connection goes back to the pool before any slow AI call is made.
+    tool_result = None
+    if intent in DB_INTENTS:
+        with borrow_connection() as conn:
+            tool_result = _run_db_tool(conn, intent, user_query, user_id)
+
     if intent == 'find_bestsellers':
-        products = find_bestsellers(db_url)
+        products = tool_result
         if products:
             response_payload["text"] = "Of course! Here are our current top-selling products:"
             response_payload["products"] = products
     elif intent == 'find_reviews':
-        reviews = find_reviews_for_product(db_url, user_query)
+        reviews = tool_result
         if reviews:
             product_name = reviews[0]['name']
             response_payload["text"] = f"Absolutely! Here are the top reviews for '{product_name}':\n" + "\n".join([f'- "{r["comment"]}" ({r["rating"]}/5 stars)' for r in reviews])
         else:
             response_payload["text"] = "I'm sorry, I couldn't find any reviews for that product."
     elif intent == 'get_order_history':
-        response_payload.update(get_user_order_history(db_url, user_id))
+        response_payload.update(tool_result)
+    elif intent == 'find_similar':
+        anchor, products = find_similar_products(user_query)
+        if products:
+            response_payload["text"] = f"If you like the {anchor['name']}, you might also like:"
+            response_payload["products"] = products
+        else:
+            response_payload["text"] = "Tell me which product you have in mind and I'll suggest a few that go well with it."
     elif intent == 'get_return_policy':
         response_payload["text"] = "We have a 30-day return policy for unworn items. You can start a return from your 'My Orders' page once an order is delivered."
     elif intent == 'greeting':
         response_payload["text"] = "Hello! I'm Aura Assistant. How can I help you find products or check reviews?"
     elif intent == 'find_product':
-        products = find_relevant_products(db_url, user_query)
+        products = tool_result
         if products:
             response_payload["text"] = "Certainly! Here are some products I found for you:"
             response_payload["products"] = products
@@ -188,9 +226,12 @@ AURA ASSISTANT (Concise, helpful response):"""
     
     if response_payload.get("products"):
         response_payload["products"] = [
-            {"id": p.get('id'), "name": p.get('name'), "image_url": p.get('image_url'), "sale_price": f"₹{float(p.get('original_price', 0)) * (1 - p.get('discount_percent', 0) / 100.0):.0f}"}
+            {"id": p.get('id'), "name": p.get('name'), "image_url": p.get('image_url'), "image_src": image_url(p.get('image_url'), 160),
+             "sale_price": f"₹{p.get('sale_price') or 0:.0f}"}
             for p in response_payload["products"]
         ]
+    for order in response_payload.get("orders") or []:
+        order["image_src"] = image_url(order.get('image_url'), 160)
     return response_payload
 
 # --- END OF FINAL, CORRECTED chatbot_logic.py ---
\ No newline at end of file
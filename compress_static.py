@@ -0,0 +1,63 @@
+import os
+import sys
+import gzip
+import time
+import argparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+# Text assets worth precompressing; images are already compressed formats.
+EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+MIN_SIZE = 1024
+
+
+def _write_if_smaller(path, data, original_size):
+    """Keeps a compressed copy only when it actually saves bytes."""
+    if len(data) >= original_size:
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+
+def compress_all():
+    """
+    Writes .gz (and .br when the brotli package is installed) next to every
+    text asset under static/, at maximum compression. compression.py serves
+    them in place of the original when the client accepts the encoding.
+    """
+    started = time.perf_counter()
+    written, saved = 0, 0
+    for root, _, files in os.walk(STATIC_DIR):
+        for name in files:
+            if not name.endswith(EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            if len(data) < MIN_SIZE:
+                continue
+            variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append(('.br', brotli.compress(data, quality=11)))
+            for suffix, compressed in variants:
+                if _write_if_smaller(path + suffix, compressed, len(data)):
+                    written += 1
+                    saved += len(data) - len(compressed)
+    print(f"Precompressed {written} static file(s), {saved / 1024:.0f} KiB saved, in {time.perf_counter() - started:.1f}s.")
+
+
+def main(argv=None):
+    argparse.ArgumentParser(description="Precompress text assets under static/ with gzip and brotli.").parse_args(argv)
+    compress_all()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import os
+import zlib
+import mimetypes
+from flask import request, send_from_directory, current_app
+
+try:
+    import brotli
+except ImportError:  # gzip alone still does most of the work
+    brotli = None
+
+# --- 1. SETTINGS ---
+# Below this many bytes the encoding overhead outweighs the savings.
+MIN_SIZE = 1024
+# Dynamic responses are compressed per request, so favour speed; static files
+# are compressed once at build time (compress_static.py) at maximum levels.
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = {'application/json', 'application/javascript', 'application/xml', 'image/svg+xml'}
+# Precompressed siblings compress_static.py writes, in order of preference.
+STATIC_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _is_compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+
+def _accepted_encodings():
+    """Encodings the client accepts and we can produce, best first."""
+    accepted = request.accept_encodings
+    encodings = []
+    if brotli is not None and accepted['br']:
+        encodings.append('br')
+    if accepted['gzip']:
+        encodings.append('gzip')
+    return encodings
+
+
+class _Compressor:
+    """One incremental gzip or brotli stream."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+
+    def flush(self):
+        """Everything compressed so far, without ending the stream (for streamed responses)."""
+        if self.encoding == 'br':
+            return self._brotli.flush()
+        return self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def _stream(chunks, compressor):
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress_response(response):
+    """after_request hook: gzip/brotli-encodes text responses the client accepts."""
+    if (response.direct_passthrough or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers or not _is_compressible(response.mimetype)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encodings = _accepted_encodings()
+    if not encodings:
+        return response
+
+    compressor = _Compressor(encodings[0])
+    if response.is_streamed:
+        response.response = _stream(response.response, compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < MIN_SIZE:
+            return response
+        response.set_data(compressor.compress(body) + compressor.finish())
+    response.headers['Content-Encoding'] = compressor.encoding
+    # The encoded bytes differ from the identity representation, so a strong
+    # validator would be wrong; weak still answers If-None-Match (http_cache.py).
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def send_static(filename):
+    """Replacement for Flask's static view that prefers a precompressed sibling file."""
+    static_folder = current_app.static_folder
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if _is_compressible(mimetype):
+        accepted = request.accept_encodings
+        for encoding, suffix in STATIC_ENCODINGS:
+            if accepted[encoding] and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+                response = send_from_directory(static_folder, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                response.vary.add('Accept-Encoding')
+                return response
+    response = send_from_directory(static_folder, filename)
+    if _is_compressible(mimetype):
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
+    app.view_functions['static'] = send_static
@@ -0,0 +1,242 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+
+# --- 1. CONFIGURATION ---
+# All pool settings can be tuned per deployment without code changes.
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX", "10"))
+# Connections older than this (seconds) are closed and replaced, so server-side
+# memory growth and load balancer idle cut-offs never reach a request.
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+# Connections idle for longer than this (seconds) are pinged before being handed out.
+POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))
+# How long (seconds) a request waits for a free connection before giving up.
+POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """Raised when no connection becomes available within the checkout timeout."""
+
+
+def resolve_database_url():
+    """Returns DATABASE_URL with SSL enforced, as required by our hosted Postgres."""
+    db_url = os.getenv("DATABASE_URL")
+    if db_url and 'sslmode' not in db_url:
+        db_url += ("&" if "?" in db_url else "?") + "sslmode=require"
+    return db_url
+
+
+# --- 2. EVENTLET SUPPORT ---
+def _eventlet_wait_callback(conn, timeout=-1):
+    """Yields to the eventlet hub while psycopg2 waits on the socket."""
+    from eventlet.hubs import trampoline
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            trampoline(conn.fileno(), read=True)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            trampoline(conn.fileno(), write=True)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state}")
+
+
+def enable_green_wait():
+    """
+    Makes psycopg2 cooperative under eventlet. Without this, a slow query blocks
+    the whole worker (and every other green thread) until Postgres answers.
+    Safe to call more than once; a no-op when eventlet is not installed.
+    """
+    try:
+        import eventlet  # noqa: F401
+    except ImportError:
+        return False
+    psycopg2.extensions.set_wait_callback(_eventlet_wait_callback)
+    return True
+
+
+# --- 3. CONNECTION POOL ---
+class ConnectionPool:
+    """
+    A bounded pool of PostgreSQL connections.
+
+    Idle connections are reused most-recently-used first so the warmest ones stay
+    busy. On checkout, connections past their max lifetime are recycled and ones
+    that sat idle for a while are health-checked with a cheap ``SELECT 1``.
+    The pool is guarded by a ``threading.Condition``; under the gunicorn eventlet
+    worker ``threading`` is monkey-patched, so waiting for a connection only
+    parks the current green thread.
+    """
+
+    def __init__(self, dsn, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 max_lifetime=POOL_MAX_LIFETIME, health_check_after=POOL_HEALTH_CHECK_AFTER,
+                 checkout_timeout=POOL_CHECKOUT_TIMEOUT):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("Invalid pool sizing: need 1 <= max_size and min_size <= max_size.")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+        self._cond = threading.Condition()
+        self._idle = deque()      # (conn, last_used) pairs, most recent on the right
+        self._born = {}           # id(conn) -> creation time
+        self._size = 0            # idle + checked-out connections
+        self._closed = False
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        self._born[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        """Closes a connection and frees its slot. Caller must NOT hold the lock."""
+        self._born.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _expired(self, conn):
+        born = self._born.get(id(conn))
+        return born is None or (time.monotonic() - born) > self.max_lifetime
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def warm(self):
+        """Opens connections up to min_size so the first requests skip the handshake."""
+        opened = []
+        with self._cond:
+            missing = max(0, self.min_size - self._size)
+            self._size += missing
+        try:
+            for _ in range(missing):
+                opened.append(self._connect())
+        finally:
+            with self._cond:
+                self._size -= missing - len(opened)
+                now = time.monotonic()
+                for conn in opened:
+                    self._idle.append((conn, now))
+                self._cond.notify_all()
+        return len(opened)
+
+    def getconn(self):
+        """Checks out a healthy connection, opening one if the pool has room."""
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            conn, last_used = None, None
+            with self._cond:
+                if self._closed:
+                    raise psycopg2.InterfaceError("Connection pool is closed.")
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No database connection available after {self.checkout_timeout}s.")
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._expired(conn) or conn.closed:
+                self._discard(conn)
+                continue
+            if (time.monotonic() - last_used) > self.health_check_after and not self._is_healthy(conn):
+                self._discard(conn)
+                continue
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """Returns a connection to the pool, rolling back anything left uncommitted."""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        if discard or conn.closed or self._closed or self._expired(conn):
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks a connection out and always gives it back."""
+        conn = self.getconn()
+        try:
+            yield conn
+        except psycopg2.Error:
+            self.putconn(conn, discard=conn.closed != 0)
+            raise
+        except Exception:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "max_size": self.max_size}
+
+
+# --- 4. PROCESS-WIDE POOL ---
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the pool for this process, creating it on first use. The pool is
+    rebuilt after a fork so worker processes never share sockets with the master.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = ConnectionPool(resolve_database_url())
+            _pool_pid = pid
+    return _pool
@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+
+from catalog import get_catalog, on_refresh
+
+# --- 1. FACET DEFINITIONS ---
+# Price buckets offered by the listing sidebar: (filter value, low, high). Bounds
+# are inclusive on both ends, exactly like the old SQL BETWEEN on sale price.
+PRICE_BUCKETS = [
+    ('0-1000', 0, 1000),
+    ('1000-2500', 1000, 2500),
+    ('2500-5000', 2500, 5000),
+    ('5000-99999', 5000, 99999),
+]
+# "N stars & up" thresholds offered by the sidebar.
+RATING_THRESHOLDS = ['4.5', '4.0']
+FACETS = ('category', 'brand', 'price', 'rating')
+# Distinct filter combinations whose counts we keep per catalog version.
+COUNTS_CACHE_SIZE = 256
+
+
+def _price_ids(snapshot, low, high):
+    return frozenset(p['id'] for p in snapshot.products if low <= p['sale_price'] <= high)
+
+
+def _rating_ids(snapshot, minimum):
+    return frozenset(p['id'] for p in snapshot.products if p['rating'] is not None and p['rating'] >= minimum)
+
+
+class FacetIndex:
+    """
+    Per-value id sets for every listing facet, built once per catalog snapshot.
+
+    Filtering is a set intersection (smallest set first), and the count shown
+    next to each sidebar option is the size of its set intersected with every
+    *other* active filter. That way picking a brand still shows how many
+    products each of the other brands has. Counts are cached per filter
+    combination; the whole index is replaced when the catalog changes.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        self.all_ids = frozenset(snapshot.by_id)
+        self.values = {
+            'category': {k: frozenset(p['id'] for p in v) for k, v in snapshot.by_category.items() if k is not None},
+            'brand': {k: frozenset(p['id'] for p in v) for k, v in snapshot.by_brand.items() if k is not None},
+            'price': {key: _price_ids(snapshot, low, high) for key, low, high in PRICE_BUCKETS},
+            'rating': {key: _rating_ids(snapshot, float(key)) for key in RATING_THRESHOLDS},
+        }
+        self._counts_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ids_for(self, facet, value):
+        """The ids matching one filter value, including values outside the sidebar presets."""
+        known = self.values[facet].get(value)
+        if known is not None:
+            return known
+        try:
+            if facet == 'price':
+                low, high = (int(v) for v in value.split('-'))
+                return _price_ids(self.snapshot, low, high)
+            if facet == 'rating':
+                return _rating_ids(self.snapshot, float(value))
+        except ValueError:
+            pass
+        return frozenset()
+
+    def matching_ids(self, filters, restrict_to=None):
+        """Ids matching every active filter (and restrict_to, e.g. search hits)."""
+        sets = [self.ids_for(facet, value) for facet, value in filters.items() if value and facet in self.values]
+        if restrict_to is not None:
+            sets.append(frozenset(restrict_to))
+        if not sets:
+            return self.all_ids
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def counts(self, filters, restrict_to=None, restrict_key=None):
+        """
+        {facet: {value: count}} for the sidebar. Pass restrict_key (e.g. the search
+        query) along with restrict_to so the result can be cached.
+        """
+        active = tuple(sorted((f, v) for f, v in filters.items() if v and f in self.values))
+        cache_key = (active, restrict_key) if restrict_to is None or restrict_key is not None else None
+        if cache_key is not None:
+            with self._lock:
+                cached = self._counts_cache.get(cache_key)
+                if cached is not None:
+                    self._counts_cache.move_to_end(cache_key)
+                    return cached
+
+        result = {}
+        for facet in FACETS:
+            others = {f: v for f, v in active if f != facet}
+            base = self.matching_ids(others, restrict_to)
+            result[facet] = {value: len(base & ids) for value, ids in self.values[facet].items()}
+
+        if cache_key is not None:
+            with self._lock:
+                self._counts_cache[cache_key] = result
+                if len(self._counts_cache) > COUNTS_CACHE_SIZE:
+                    self._counts_cache.popitem(last=False)
+        return result
+
+
+# --- 2. PROCESS-WIDE INDEX ---
+_index = None
+
+
+@on_refresh
+def _rebuild(old_snapshot, new_snapshot):
+    global _index
+    _index = FacetIndex(new_snapshot)
+
+
+def get_facets():
+    """Returns the facet index for the current catalog, rebuilding it if stale."""
+    global _index
+    catalog = get_catalog()
+    index = _index
+    if index is None or index.version != catalog.version:
+        index = _index = FacetIndex(catalog)
+    return index
@@ -0,0 +1,114 @@
+import uuid
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+from flask import render_template
+
+from change_feed import feed
+
+# Channels our inventory and reviews triggers (migration 6) notify on, with the product id.
+INVENTORY_CHANNEL = "inventory_changed"
+REVIEWS_CHANNEL = "reviews_changed"
+
+# Bounds for the rendered fragments kept per process.
+FRAGMENT_CACHE_ENTRIES = 2048
+FRAGMENT_CACHE_BYTES = 16 * 1024 * 1024
+
+
+class FragmentCache:
+    """
+    A thread-safe LRU of rendered HTML fragments, bounded both by entry count
+    and by the total size of the stored markup.
+    """
+
+    def __init__(self, max_entries=FRAGMENT_CACHE_ENTRIES, max_bytes=FRAGMENT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._fragments.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._fragments.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def set(self, key, html):
+        with self._lock:
+            previous = self._fragments.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._fragments[key] = html
+            self.size += len(html)
+            while self._fragments and (len(self._fragments) > self.max_entries or self.size > self.max_bytes):
+                _, evicted = self._fragments.popitem(last=False)
+                self.size -= len(evicted)
+
+
+cache = FragmentCache()
+
+
+# --- DATA VERSIONS ---
+# Product rows carry their own content version (catalog.product_versions). For
+# inventory and reviews each process counts the NOTIFYs it has seen per
+# product; the epoch moves on every (re)connect, because notifications sent
+# while we weren't listening are lost and any fragment may then be stale.
+# The counters are local to this process, so versions carry a process id
+# too: they are safe to hand out in ETags, which another worker won't match.
+_process_id = uuid.uuid4().hex[:8]
+_epoch = 0
+_generations = {}
+_versions_lock = threading.Lock()
+
+
+def data_version(kind, product_id):
+    """A value that changes whenever ``kind`` ('inventory' or 'reviews') data for the product changes."""
+    return (_process_id, _epoch, _generations.get((kind, product_id), 0))
+
+
+def touch(kind, product_id):
+    """
+    Moves the product's ``kind`` version on at once in this process. Call it
+    after committing a write, so the writer's own next request can't be
+    answered from the old version before the NOTIFY arrives.
+    """
+    with _versions_lock:
+        key = (kind, product_id)
+        _generations[key] = _generations.get(key, 0) + 1
+
+
+def _bump(kind):
+    def on_change(payloads):
+        global _epoch
+        with _versions_lock:
+            if payloads is None:
+                _epoch += 1
+                return
+            for payload in set(payloads):
+                key = (kind, int(payload))
+                _generations[key] = _generations.get(key, 0) + 1
+    return on_change
+
+
+feed.subscribe(INVENTORY_CHANNEL, _bump('inventory'))
+feed.subscribe(REVIEWS_CHANNEL, _bump('reviews'))
+
+
+def render_fragment(key, template_name, build_context):
+    """
+    Renders a partial template once per key and serves the cached markup
+    after that. ``key`` must include every version the fragment depends on;
+    ``build_context`` (which may hit the database) only runs on a miss.
+    """
+    html = cache.get(key)
+    if html is None:
+        html = Markup(render_template(template_name, **build_context()))
+        cache.set(key, html)
+    return html
@@ -0,0 +1,33 @@
+import hashlib
+from flask import request, make_response
+
+# Cache-Control per class of endpoint.
+CACHE_POLICIES = {
+    # Derived from the catalog alone; a minute of staleness is fine for a preview.
+    'catalog': 'public, max-age=60',
+    # New reviews should show up at once, so browsers always revalidate (a 304 is cheap).
+    'reviews': 'public, no-cache',
+}
+
+
+def make_etag(*parts):
+    """A strong ETag for a response determined entirely by ``parts`` (data versions, arguments)."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:24]
+
+
+def conditional_response(etag, policy, build):
+    """
+    Answers 304 Not Modified when the client already holds ``etag``;
+    otherwise calls ``build`` (where any queries or rendering happen) and
+    tags its response. Either way the endpoint's Cache-Control is set, and
+    Vary too: compression.py adds it to the 200 but skips 304s, and caches
+    should see the same Vary on both.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_POLICIES[policy]
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,68 @@
+import os
+import json
+from markupsafe import Markup, escape
+from flask import url_for
+
+# Written by build_images.py; without it every helper falls back to the original file.
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'images', 'products', 'variants', 'manifest.json')
+# Fingerprinted variants never change under the same name, so browsers may keep them for a year.
+VARIANTS_URL_PREFIX = '/static/images/products/variants/'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# `sizes` attribute per place an image is shown, matching the CSS grid breakpoints.
+SIZES = {
+    'card': '(max-width: 576px) 50vw, (max-width: 992px) 33vw, 300px',
+    'detail': '(max-width: 992px) 100vw, 50vw',
+    'thumb': '120px',
+}
+# Preferred first: browsers take the first <source> type they support.
+FORMATS = ('avif', 'webp')
+
+_manifest = None
+
+
+def get_manifest():
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(MANIFEST_PATH) as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            print("--- IMAGES: no variant manifest; serving original images (run build_images.py) ---")
+            _manifest = {}
+    return _manifest
+
+
+def _static(path):
+    return url_for('static', filename='images/products/' + path)
+
+
+def image_url(filename, width=320):
+    """URL of the smallest WebP variant at least ``width`` px wide (for JSON clients), else the original."""
+    variants = get_manifest().get(filename, {}).get('webp')
+    if not variants:
+        return _static(filename)
+    for variant_width, path in variants:
+        if variant_width >= width:
+            return _static(path)
+    return _static(variants[-1][1])
+
+
+def product_image(filename, sizes='card', alt='', class_=None, lazy=True):
+    """
+    A <picture> element offering AVIF and WebP at every generated width, with
+    the original image as the <img> fallback. ``sizes`` is a key of SIZES or
+    a literal sizes attribute.
+    """
+    entry = get_manifest().get(filename, {})
+    sizes_attr = SIZES.get(sizes, sizes)
+    sources = [
+        f'<source type="image/{fmt}" srcset="{escape(", ".join(f"{_static(path)} {width}w" for width, path in entry[fmt]))}" sizes="{escape(sizes_attr)}">'
+        for fmt in FORMATS if entry.get(fmt)
+    ]
+    img_attrs = [f'src="{escape(_static(filename))}"', f'alt="{escape(alt)}"']
+    if class_:
+        img_attrs.append(f'class="{escape(class_)}"')
+    if lazy:
+        img_attrs.append('loading="lazy" decoding="async"')
+    return Markup(f'<picture>{"".join(sources)}<img {" ".join(img_attrs)}></picture>')
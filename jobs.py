@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import argparse
+import importlib
+import threading
+import psycopg2
+import psycopg2.extras
+from dotenv import load_dotenv
+
+from db_pool import get_pool
+from change_feed import feed
+
+# --- 1. SETTINGS ---
+# enqueue() NOTIFYs this channel so idle dispatchers wake up at once.
+JOBS_CHANNEL = "jobs_enqueued"
+# Dispatchers also look for due jobs (retries, delayed jobs) this often (seconds).
+POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "10"))
+# Failed jobs are retried after RETRY_BASE_DELAY * 2**attempts seconds, and
+# given up on (kept, with failed_at set) after MAX_ATTEMPTS.
+RETRY_BASE_DELAY = 5
+MAX_ATTEMPTS = 5
+# Modules whose handlers a standalone worker (python jobs.py) must register.
+HANDLER_MODULES = ["orders"]
+
+_handlers = {}
+
+
+def handler(kind):
+    """Registers the function that runs jobs of ``kind``, called as fn(cursor, payload)."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+# --- 2. ENQUEUE ---
+def enqueue(cursor, kind, payload, delay=0):
+    """
+    Queues a job in the caller's transaction: it only becomes visible (and
+    dispatchers are only woken) when that transaction commits, so a job never
+    runs for an order or review that was rolled back.
+    """
+    cursor.execute("INSERT INTO jobs (kind, payload, run_at) VALUES (%s, %s, NOW() + %s * INTERVAL '1 second')",
+                   (kind, json.dumps(payload), delay))
+    cursor.execute("SELECT pg_notify(%s, %s)", (JOBS_CHANNEL, kind))
+
+
+# --- 3. RUNNING JOBS ---
+def run_one(conn):
+    """
+    Claims the oldest due job and runs it. The job row stays locked while
+    the handler runs and is deleted in the same transaction as the
+    handler's own writes, so a job's effects are committed exactly once. On
+    failure only the handler's writes are rolled back (to a savepoint) and
+    the still-locked row is rescheduled, so no other dispatcher can pick it
+    up before its backoff. Returns False when nothing was due.
+    """
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        cursor.execute("""
+            SELECT id, kind, payload, attempts FROM jobs WHERE run_at <= NOW() AND failed_at IS NULL
+            ORDER BY run_at LIMIT 1 FOR UPDATE SKIP LOCKED
+        """)
+        job = cursor.fetchone()
+        if job is None:
+            conn.rollback()
+            return False
+        cursor.execute("SAVEPOINT job")
+        try:
+            fn = _handlers.get(job['kind'])
+            if fn is None:
+                raise LookupError(f"no handler for job kind '{job['kind']}'")
+            fn(cursor, job['payload'])
+            cursor.execute("DELETE FROM jobs WHERE id = %s", (job['id'],))
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT job")
+            _reschedule(cursor, job, e)
+        conn.commit()
+        return True
+    finally:
+        cursor.close()
+
+
+def _reschedule(cursor, job, error):
+    attempts = job['attempts'] + 1
+    if attempts >= MAX_ATTEMPTS:
+        print(f"--- JOBS: {job['kind']} #{job['id']} failed {attempts} times, giving up: {error} ---")
+        cursor.execute("UPDATE jobs SET attempts = %s, last_error = %s, failed_at = NOW() WHERE id = %s", (attempts, str(error), job['id']))
+    else:
+        print(f"--- JOBS: {job['kind']} #{job['id']} failed ({error}); retry {attempts} of {MAX_ATTEMPTS - 1} ---")
+        cursor.execute("UPDATE jobs SET attempts = %s, last_error = %s, run_at = NOW() + %s * INTERVAL '1 second' WHERE id = %s",
+                       (attempts, str(error), RETRY_BASE_DELAY * 2 ** attempts, job['id']))
+
+
+def run_pending(conn, limit=100):
+    """Runs due jobs until none are left (or ``limit`` ran). Returns how many ran."""
+    ran = 0
+    while ran < limit and run_one(conn):
+        ran += 1
+    return ran
+
+
+# --- 4. DISPATCH ---
+# Set from the change feed's green thread; the dispatcher waits on it. Under
+# eventlet, threading is monkey-patched, so waiting only parks a green thread.
+_wakeup = threading.Event()
+
+
+def _on_enqueued(payloads):
+    _wakeup.set()
+
+
+feed.subscribe(JOBS_CHANNEL, _on_enqueued)
+
+
+def run_dispatcher():
+    """
+    Blocking loop that drains the queue whenever a job is enqueued (or every
+    POLL_INTERVAL seconds). Start it with socketio.start_background_task in
+    each web worker, or run python jobs.py as a separate worker; any number
+    of them can share the queue.
+    """
+    while True:
+        _wakeup.wait(POLL_INTERVAL)
+        _wakeup.clear()
+        try:
+            with get_pool().connection() as conn:
+                run_pending(conn)
+        except psycopg2.Error as e:
+            print(f"--- JOBS: dispatch failed ({e}); retrying in {POLL_INTERVAL:.0f}s ---")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run queued background jobs.")
+    parser.add_argument("--once", action="store_true", help="run the jobs that are due now, then exit")
+    args = parser.parse_args(argv)
+    load_dotenv()
+    for module in HANDLER_MODULES:
+        importlib.import_module(module)
+    if args.once:
+        with get_pool().connection() as conn:
+            print(f"Ran {run_pending(conn, limit=sys.maxsize)} job(s).")
+        return 0
+    print(f"Job worker started; handling {', '.join(sorted(_handlers))}.")
+    threading.Thread(target=feed.run_forever, daemon=True).start()
+    run_dispatcher()
+    return 0
+
+
+if __name__ == '__main__':
+    # Run through the importable module so that handlers registered by
+    # `import jobs` in HANDLER_MODULES land in the registry main() uses.
+    import jobs
+    sys.exit(jobs.main())
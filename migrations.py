@@ -0,0 +1,351 @@
+import sys
+import json
+import time
+import argparse
+import psycopg2
+import psycopg2.extras
+from dotenv import load_dotenv
+
+from db_pool import resolve_database_url
+
+# --- 1. MIGRATION REGISTRY ---
+# Forward-only: each entry is (version, description, [statements]). Never edit a
+# migration that has shipped; add a new one instead. Every migration runs in its
+# own transaction together with the row that records it in schema_migrations.
+MIGRATIONS = [
+    (1, "baseline schema", [
+        """CREATE TABLE IF NOT EXISTS products (id INT PRIMARY KEY, name TEXT NOT NULL, description TEXT, long_description TEXT, original_price NUMERIC(10, 2) NOT NULL, discount_percent INTEGER NOT NULL DEFAULT 0, image_url TEXT, category TEXT, brand TEXT, color TEXT, rating NUMERIC(3, 1), num_ratings INTEGER NOT NULL DEFAULT 0);""",
+        """CREATE TABLE IF NOT EXISTS inventory (id SERIAL PRIMARY KEY, product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE, size TEXT NOT NULL, stock_quantity INTEGER NOT NULL, UNIQUE(product_id, size));""",
+        """CREATE TABLE IF NOT EXISTS users (id SERIAL PRIMARY KEY, username TEXT UNIQUE NOT NULL, email TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL, first_name TEXT NOT NULL, last_name TEXT NOT NULL, phone TEXT NOT NULL);""",
+        """CREATE TABLE IF NOT EXISTS addresses (id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, address TEXT NOT NULL, city TEXT NOT NULL, state TEXT NOT NULL, zip_code TEXT NOT NULL, is_default BOOLEAN NOT NULL DEFAULT FALSE);""",
+        """CREATE TABLE IF NOT EXISTS orders (id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, shipping_address_id INTEGER NOT NULL REFERENCES addresses(id), payment_method TEXT NOT NULL, payment_details TEXT, order_date TIMESTAMP NOT NULL, total_price NUMERIC(10, 2) NOT NULL, status TEXT DEFAULT 'Completed', tracking_number TEXT, shipping_status TEXT);""",
+        """CREATE TABLE IF NOT EXISTS order_items (id SERIAL PRIMARY KEY, order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE, product_id INTEGER NOT NULL REFERENCES products(id), inventory_id INTEGER NOT NULL REFERENCES inventory(id), size TEXT NOT NULL, quantity INTEGER NOT NULL, price NUMERIC(10, 2) NOT NULL, has_reviewed BOOLEAN NOT NULL DEFAULT FALSE);""",
+        """CREATE TABLE IF NOT EXISTS reviews (id SERIAL PRIMARY KEY, product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, rating INTEGER NOT NULL, comment TEXT NOT NULL, review_date TIMESTAMP NOT NULL);""",
+        """CREATE TABLE IF NOT EXISTS wishlist (id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, product_id INTEGER NOT NULL REFERENCES products(id), added_date TIMESTAMP NOT NULL, UNIQUE(user_id, product_id));""",
+    ]),
+    # Each index mirrors the WHERE + ORDER BY of a hot query (see HOT_QUERIES below).
+    # inventory(product_id, size) is already covered by its UNIQUE constraint and
+    # wishlist(user_id, product_id) likewise, so neither gets a duplicate index.
+    (2, "hot-path indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_reviews_product_date ON reviews (product_id, review_date DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_reviews_product_rating_high ON reviews (product_id, rating DESC, review_date DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_reviews_product_rating_low ON reviews (product_id, rating ASC, review_date DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_date ON orders (user_id, order_date DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id);",
+        "CREATE INDEX IF NOT EXISTS idx_products_category ON products (category);",
+        "CREATE INDEX IF NOT EXISTS idx_products_top_rated ON products (rating DESC NULLS LAST, num_ratings DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_addresses_user ON addresses (user_id, is_default DESC);",
+    ]),
+    # Every write to products NOTIFYs 'catalog_changed' (delivered on commit) so
+    # each worker's in-memory catalog snapshot (catalog.py) can reload itself.
+    (3, "catalog change notifications", [
+        """CREATE OR REPLACE FUNCTION notify_catalog_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('catalog_changed', OLD.id::text);
+            ELSE
+                PERFORM pg_notify('catalog_changed', NEW.id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;""",
+        "DROP TRIGGER IF EXISTS products_notify_catalog_changed ON products;",
+        """CREATE TRIGGER products_notify_catalog_changed AFTER INSERT OR UPDATE OR DELETE ON products
+        FOR EACH ROW EXECUTE FUNCTION notify_catalog_changed();""",
+    ]),
+    # The discounted price used to be recomputed from original_price and
+    # discount_percent by every query and view; store it once so price filters
+    # and sorts are plain index range scans.
+    (4, "stored sale_price column", [
+        """ALTER TABLE products ADD COLUMN IF NOT EXISTS sale_price NUMERIC(10, 2)
+        GENERATED ALWAYS AS (original_price * (1 - discount_percent / 100.0)) STORED;""",
+        "CREATE INDEX IF NOT EXISTS idx_products_sale_price ON products (sale_price);",
+    ]),
+    # How many orders contained both products, stored in both directions so a
+    # product's partners are one primary-key range. Backfilled from existing
+    # orders here; checkout keeps it current (recommendations.record_order).
+    (5, "co-purchase counts", [
+        """CREATE TABLE IF NOT EXISTS product_co_purchases (product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE, other_product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE, orders_count INTEGER NOT NULL, PRIMARY KEY (product_id, other_product_id));""",
+        """INSERT INTO product_co_purchases (product_id, other_product_id, orders_count)
+        SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id)
+        FROM order_items a JOIN order_items b ON a.order_id = b.order_id AND a.product_id <> b.product_id
+        GROUP BY a.product_id, b.product_id
+        ON CONFLICT DO NOTHING;""",
+    ]),
+    # Inventory and review writes NOTIFY the affected product id, which is what
+    # versions the cached product page fragments (fragment_cache.py).
+    (6, "inventory and review change notifications", [
+        """CREATE OR REPLACE FUNCTION notify_product_data_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify(TG_ARGV[0], OLD.product_id::text);
+            ELSE
+                PERFORM pg_notify(TG_ARGV[0], NEW.product_id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;""",
+        "DROP TRIGGER IF EXISTS inventory_notify_changed ON inventory;",
+        """CREATE TRIGGER inventory_notify_changed AFTER INSERT OR UPDATE OR DELETE ON inventory
+        FOR EACH ROW EXECUTE FUNCTION notify_product_data_changed('inventory_changed');""",
+        "DROP TRIGGER IF EXISTS reviews_notify_changed ON reviews;",
+        """CREATE TRIGGER reviews_notify_changed AFTER INSERT OR UPDATE OR DELETE ON reviews
+        FOR EACH ROW EXECUTE FUNCTION notify_product_data_changed('reviews_changed');""",
+    ]),
+    # Review pages seek past the last (rating,) review_date, id they showed
+    # (reviews.py), so the id joins each review index; 'oldest' scans the
+    # newest-first index backwards.
+    (7, "review keyset pagination indexes", [
+        "CREATE INDEX IF NOT EXISTS idx_reviews_product_date_id ON reviews (product_id, review_date DESC, id DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_reviews_product_rating_high_id ON reviews (product_id, rating DESC, review_date DESC, id DESC);",
+        "CREATE INDEX IF NOT EXISTS idx_reviews_product_rating_low_id ON reviews (product_id, rating ASC, review_date DESC, id DESC);",
+        "DROP INDEX IF EXISTS idx_reviews_product_date;",
+        "DROP INDEX IF EXISTS idx_reviews_product_rating_high;",
+        "DROP INDEX IF EXISTS idx_reviews_product_rating_low;",
+    ]),
+    # Running sum, count and 1-5 star histogram per product, updated in the
+    # review's own transaction (reviews.record_rating) instead of re-averaging
+    # every review of the product on each submission.
+    (8, "product rating aggregates", [
+        """CREATE TABLE IF NOT EXISTS product_rating_stats (product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE, rating_sum INTEGER NOT NULL DEFAULT 0, rating_count INTEGER NOT NULL DEFAULT 0, stars_1 INTEGER NOT NULL DEFAULT 0, stars_2 INTEGER NOT NULL DEFAULT 0, stars_3 INTEGER NOT NULL DEFAULT 0, stars_4 INTEGER NOT NULL DEFAULT 0, stars_5 INTEGER NOT NULL DEFAULT 0);""",
+        """INSERT INTO product_rating_stats (product_id, rating_sum, rating_count, stars_1, stars_2, stars_3, stars_4, stars_5)
+        SELECT product_id, SUM(rating), COUNT(*),
+               COUNT(*) FILTER (WHERE rating = 1), COUNT(*) FILTER (WHERE rating = 2), COUNT(*) FILTER (WHERE rating = 3),
+               COUNT(*) FILTER (WHERE rating = 4), COUNT(*) FILTER (WHERE rating = 5)
+        FROM reviews GROUP BY product_id
+        ON CONFLICT DO NOTHING;""",
+    ]),
+    # Server-side carts (cart_store.py): the session cookie only holds the id.
+    # A signed-in user has at most one cart, which follows them across devices.
+    (9, "server-side carts", [
+        """CREATE TABLE IF NOT EXISTS carts (id TEXT PRIMARY KEY, user_id INTEGER UNIQUE REFERENCES users(id) ON DELETE CASCADE, items TEXT NOT NULL DEFAULT '', updated_at TIMESTAMP NOT NULL DEFAULT NOW());""",
+    ]),
+    # Cart lines hold their units for a while (reservations.py). Each hold
+    # moves reserved_quantity by its difference, so available_quantity is
+    # always current without summing holds; expired holds are swept back.
+    (10, "inventory holds", [
+        "ALTER TABLE inventory ADD COLUMN IF NOT EXISTS reserved_quantity INTEGER NOT NULL DEFAULT 0;",
+        """ALTER TABLE inventory ADD COLUMN IF NOT EXISTS available_quantity INTEGER
+        GENERATED ALWAYS AS (stock_quantity - reserved_quantity) STORED;""",
+        # Holds and sales only ever move units that exist; a bug (or a crafted
+        # request) that would oversell fails loudly instead.
+        "ALTER TABLE inventory ADD CONSTRAINT inventory_reserved_quantity_check CHECK (reserved_quantity >= 0);",
+        "ALTER TABLE inventory ADD CONSTRAINT inventory_stock_quantity_check CHECK (stock_quantity >= 0);",
+        """CREATE TABLE IF NOT EXISTS inventory_holds (cart_id TEXT NOT NULL, inventory_id INTEGER NOT NULL REFERENCES inventory(id) ON DELETE CASCADE, quantity INTEGER NOT NULL, expires_at TIMESTAMP NOT NULL, PRIMARY KEY (cart_id, inventory_id));""",
+        "CREATE INDEX IF NOT EXISTS idx_inventory_holds_expires ON inventory_holds (expires_at);",
+    ]),
+    # Each checkout form carries a one-off key (orders.place_order); replaying
+    # the submission finds the order it already placed instead of a new one.
+    # NULL keys (orders placed without one) never conflict.
+    (11, "checkout idempotency keys", [
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS idempotency_key TEXT;",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_user_idempotency_key ON orders (user_id, idempotency_key);",
+    ]),
+    # Background work queued by requests (jobs.py). Workers claim the oldest
+    # due row with FOR UPDATE SKIP LOCKED; rows that keep failing stay, with
+    # failed_at set, for someone to look at.
+    (12, "background job queue", [
+        """CREATE TABLE IF NOT EXISTS jobs (id BIGSERIAL PRIMARY KEY, kind TEXT NOT NULL, payload JSONB NOT NULL, run_at TIMESTAMP NOT NULL DEFAULT NOW(), attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT, failed_at TIMESTAMP, created_at TIMESTAMP NOT NULL DEFAULT NOW());""",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (run_at) WHERE failed_at IS NULL;",
+    ]),
+    # Order history pages seek past the last (order_date, id) they showed
+    # (orders.fetch_order_history), so the id joins the user's orders index.
+    (13, "order history keyset pagination index", [
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_date_id ON orders (user_id, order_date DESC, id DESC);",
+        "DROP INDEX IF EXISTS idx_orders_user_date;",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Arbitrary constant used with pg_advisory_xact_lock so two instances booting at
+# the same time never apply the same migration twice.
+MIGRATION_LOCK_ID = 7340021
+
+# --- 2. HOT QUERIES (used by the EXPLAIN check) ---
+# (name, sql, sample params). Keep these in sync with the queries in app.py and
+# chatbot_logic.py so the check proves the indexes above are actually usable.
+HOT_QUERIES = [
+    ("product reviews (newest, next page)",
+     "SELECT r.rating, r.comment FROM reviews r WHERE r.product_id = %s AND (r.review_date, r.id) < (NOW()::timestamp, 1000000) ORDER BY r.review_date DESC, r.id DESC LIMIT 5", (1,)),
+    ("product reviews (oldest, next page)",
+     "SELECT r.rating, r.comment FROM reviews r WHERE r.product_id = %s AND (r.review_date, r.id) > ('2000-01-01'::timestamp, 0) ORDER BY r.review_date ASC, r.id ASC LIMIT 5", (1,)),
+    ("product reviews (highest, next page)",
+     "SELECT r.rating, r.comment FROM reviews r WHERE r.product_id = %s AND (r.rating, r.review_date, r.id) < (5, NOW()::timestamp, 1000000) ORDER BY r.rating DESC, r.review_date DESC, r.id DESC LIMIT 5", (1,)),
+    ("product reviews (lowest, next page)",
+     "SELECT r.rating, r.comment FROM reviews r WHERE r.product_id = %s AND (r.rating > 1 OR (r.rating = 1 AND (r.review_date, r.id) < (NOW()::timestamp, 1000000))) ORDER BY r.rating ASC, r.review_date DESC, r.id DESC LIMIT 5", (1,)),
+    ("product rating stats",
+     "SELECT rating_count, stars_1, stars_5 FROM product_rating_stats WHERE product_id = %s", (1,)),
+    ("expired holds",
+     "SELECT cart_id, inventory_id FROM inventory_holds WHERE expires_at < NOW() ORDER BY inventory_id LIMIT 500", ()),
+    ("next due job",
+     "SELECT id FROM jobs WHERE run_at <= NOW() AND failed_at IS NULL ORDER BY run_at LIMIT 1", ()),
+    ("user cart",
+     "SELECT id, items FROM carts WHERE user_id = %s", (1,)),
+    ("order by idempotency key",
+     "SELECT id FROM orders WHERE user_id = %s AND idempotency_key = %s", (1, "replayed-key")),
+    ("user orders (next page)",
+     "SELECT * FROM orders WHERE user_id = %s AND (order_date, id) < (NOW()::timestamp, 1000000) ORDER BY order_date DESC, id DESC LIMIT 11", (1,)),
+    ("order items",
+     "SELECT oi.quantity, oi.price FROM order_items oi WHERE oi.order_id = %s", (1,)),
+    ("cart lines",
+     "SELECT p.name, i.size, i.stock_quantity FROM inventory i JOIN products p ON p.id = i.product_id WHERE i.id = ANY(%s)", ([1, 2, 3],)),
+    ("product inventory",
+     "SELECT id, size, stock_quantity FROM inventory WHERE product_id = %s ORDER BY size", (1,)),
+    ("category products",
+     "SELECT * FROM products WHERE category = %s AND id != %s", ("Tops", 1)),
+    ("top rated products",
+     "SELECT * FROM products ORDER BY rating DESC NULLS LAST, num_ratings DESC LIMIT 8", ()),
+    ("products by sale price",
+     "SELECT * FROM products WHERE sale_price < %s ORDER BY sale_price DESC LIMIT 3", (1000,)),
+    ("co-purchase partners",
+     "SELECT product_id, other_product_id, orders_count FROM product_co_purchases WHERE product_id = ANY(%s)", ([1, 2],)),
+    ("user addresses",
+     "SELECT * FROM addresses WHERE user_id = %s ORDER BY is_default DESC", (1,)),
+]
+
+# --- 3. MIGRATION ENGINE ---
+def ensure_version_table(cursor):
+    cursor.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TIMESTAMP NOT NULL DEFAULT NOW());""")
+
+def current_version(cursor):
+    """Returns the highest applied migration version, or 0 for a fresh database."""
+    cursor.execute("SELECT to_regclass('schema_migrations')")
+    if cursor.fetchone()[0] is None:
+        return 0
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cursor.fetchone()[0]
+
+def pending_migrations(cursor):
+    version = current_version(cursor)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+def migrate(conn, dry_run=False):
+    """
+    Applies every pending migration in order and returns the list of versions
+    applied. With dry_run=True nothing is executed; the pending SQL is printed.
+    """
+    cursor = conn.cursor()
+    if dry_run:
+        pending = pending_migrations(cursor)
+        conn.rollback()
+        cursor.close()
+        for version, description, statements in pending:
+            print(f"-- [dry run] migration {version}: {description}")
+            for statement in statements:
+                print(statement)
+        if not pending:
+            print("-- [dry run] schema is up to date.")
+        return [m[0] for m in pending]
+
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        # Re-check under the lock: another instance may have just applied it.
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        ensure_version_table(cursor)
+        if version <= current_version(cursor):
+            conn.commit()
+            continue
+        print(f"Applying migration {version}: {description}...")
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)", (version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            cursor.close()
+            raise
+        applied.append(version)
+    cursor.close()
+    return applied
+
+# --- 4. EXPLAIN CHECK ---
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+def explain_hot_queries(conn):
+    """
+    Runs EXPLAIN on every hot query and reports whether it can use an index.
+    Sequential scans are disabled for the check because on a small seed catalog
+    the planner would (correctly) prefer them; what we verify is that an index
+    path exists at all, which is what matters once tables grow.
+    Returns True when every query gets an index scan.
+    """
+    cursor = conn.cursor()
+    all_ok = True
+    for name, sql, params in HOT_QUERIES:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        raw_plan = cursor.fetchone()[0]
+        plan = (raw_plan if isinstance(raw_plan, list) else json.loads(raw_plan))[0]["Plan"]
+        index_nodes = [n for n in _plan_nodes(plan) if "Index" in n["Node Type"]]
+        if index_nodes:
+            used = ", ".join(sorted({n.get("Index Name", "?") for n in index_nodes}))
+            print(f"  OK    {name}: {used}")
+        else:
+            all_ok = False
+            print(f"  SCAN  {name}: {plan['Node Type']} (no index used)")
+        conn.rollback()
+    cursor.close()
+    return all_ok
+
+# --- 5. BOOT CHECK ---
+def boot():
+    """
+    Container start fast path: one connection and one version lookup. When the
+    schema is current the app starts serving immediately; pending migrations
+    (a new deploy) are applied first. Never seeds or drops anything.
+    """
+    started = time.perf_counter()
+    conn = psycopg2.connect(resolve_database_url())
+    connected = time.perf_counter()
+    try:
+        cursor = conn.cursor()
+        version = current_version(cursor)
+        conn.rollback()
+        cursor.close()
+        checked = time.perf_counter()
+        print(f"[boot] connect {1000 * (connected - started):.0f} ms, schema check {1000 * (checked - connected):.0f} ms (version {version}, latest {LATEST_VERSION})")
+        if version > LATEST_VERSION:
+            print("[boot] WARNING: database schema is newer than this build; serving anyway.")
+        elif version < LATEST_VERSION:
+            applied = migrate(conn)
+            print(f"[boot] applied migration(s) {applied} in {1000 * (time.perf_counter() - checked):.0f} ms")
+        return 0
+    finally:
+        conn.close()
+
+# --- 6. COMMAND LINE ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply AURA database schema migrations.")
+    parser.add_argument("--dry-run", action="store_true", help="print pending migrations without applying them")
+    parser.add_argument("--status", action="store_true", help="print the current schema version and exit")
+    parser.add_argument("--explain", action="store_true", help="EXPLAIN the hot queries and confirm they use indexes")
+    parser.add_argument("--boot", action="store_true", help="fast startup check: migrate only if the schema is behind")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    if args.boot:
+        return boot()
+    conn = psycopg2.connect(resolve_database_url())
+    try:
+        if args.status:
+            cursor = conn.cursor()
+            print(f"Schema version {current_version(cursor)} (latest {LATEST_VERSION}).")
+            cursor.close()
+            return 0
+        if args.explain:
+            print("Checking hot query plans...")
+            return 0 if explain_hot_queries(conn) else 1
+        applied = migrate(conn, dry_run=args.dry_run)
+        if not args.dry_run:
+            print(f"Applied {len(applied)} migration(s); schema is at version {LATEST_VERSION}.")
+        return 0
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+import uuid
+import random
+from datetime import datetime
+import psycopg2.extras
+
+import jobs
+from pagination import encode_cursor, decode_cursor
+import recommendations
+import reservations
+
+
+class OutOfStock(Exception):
+    """Raised when some cart line can no longer be covered by stock; carries those inventory ids."""
+
+    def __init__(self, inventory_ids):
+        super().__init__(f"insufficient stock for inventory {sorted(inventory_ids)}")
+        self.inventory_ids = inventory_ids
+
+
+class AlreadyPlaced(Exception):
+    """Raised when a checkout's idempotency key was already used; carries the original order id."""
+
+    def __init__(self, order_id):
+        super().__init__(f"order #{order_id} was already placed with this key")
+        self.order_id = order_id
+
+
+def new_idempotency_key():
+    """Issued with each checkout form; resubmitting the form reuses it."""
+    return uuid.uuid4().hex
+
+
+def find_order_by_key(cursor, user_id, idempotency_key):
+    """The id of the order this user already placed with the key, or None."""
+    if not idempotency_key:
+        return None
+    cursor.execute("SELECT id FROM orders WHERE user_id = %s AND idempotency_key = %s", (user_id, idempotency_key))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def decrement_stock(cursor, quantities, held=None):
+    """
+    Takes ``quantities`` ({inventory_id: quantity}) out of stock in one
+    statement, only where enough is available. ``held`` ({inventory_id:
+    quantity}, from reservations.take_holds) are the buyer's own holds: those
+    units count as available to them and stop being reserved. Rows are locked
+    in inventory id order, so two checkouts sharing several SKUs can never
+    deadlock. Raises OutOfStock, leaving the caller to roll back, if any line
+    fell short.
+    """
+    held = held or {}
+    ids = sorted(set(quantities) | set(held))
+    if not ids:
+        return
+    updated = psycopg2.extras.execute_values(cursor, """
+        WITH want (id, qty, held) AS (VALUES %s),
+             locked AS MATERIALIZED (SELECT i.id FROM inventory i JOIN want ON want.id = i.id ORDER BY i.id FOR UPDATE OF i)
+        UPDATE inventory i SET stock_quantity = i.stock_quantity - want.qty, reserved_quantity = i.reserved_quantity - want.held
+        FROM want JOIN locked ON locked.id = want.id
+        WHERE i.id = want.id AND i.available_quantity + want.held >= want.qty
+        RETURNING i.id
+    """, [(inventory_id, quantities.get(inventory_id, 0), held.get(inventory_id, 0)) for inventory_id in ids], fetch=True)
+    short = set(ids) - {row[0] for row in updated}
+    if short:
+        raise OutOfStock(short)
+
+
+def place_order(cursor, user_id, shipping_address_id, payment_method, payment_details, priced, cart_id=None, idempotency_key=None):
+    """
+    Writes an order for a priced cart (cart_pricing.PricedCart) and takes its
+    stock: the order row, every order item in one multi-row insert, an
+    'order_placed' job for the follow-up work (see below), then a single
+    conditional stock decrement that turns the cart's holds (``cart_id``)
+    into the sale. The decrement comes last so hot SKU rows stay locked only
+    until the caller commits, right after. Returns the new order id; raises
+    OutOfStock.
+
+    The order row goes in first, with ``idempotency_key``: a concurrent
+    replay of the same submission waits on the key's unique index right
+    there, before any other write, and raises AlreadyPlaced (the caller
+    rolls back) once the first one commits.
+    """
+    cursor.execute("""
+        INSERT INTO orders (user_id, shipping_address_id, payment_method, payment_details, order_date, total_price, tracking_number, shipping_status, idempotency_key)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (user_id, idempotency_key) DO NOTHING RETURNING id
+    """, (user_id, shipping_address_id, payment_method, payment_details, datetime.now(), priced.final_total_price, None, 'Processing', idempotency_key or None))
+    row = cursor.fetchone()
+    if row is None:
+        raise AlreadyPlaced(find_order_by_key(cursor, user_id, idempotency_key))
+    order_id = row[0]
+    psycopg2.extras.execute_values(cursor, "INSERT INTO order_items (order_id, product_id, inventory_id, size, quantity, price) VALUES %s",
+                                   [(order_id, line['id'], line['inventory_id'], line['size'], line['quantity'], line['sale_price']) for line in priced.lines])
+    jobs.enqueue(cursor, 'order_placed', {'order_id': order_id})
+    quantities = {}
+    for line in priced.lines:
+        quantities[line['inventory_id']] = quantities.get(line['inventory_id'], 0) + line['quantity']
+    decrement_stock(cursor, quantities, reservations.take_holds(cursor, cart_id))
+    return order_id
+
+
+# Order status changes, per action: (new status, condition on the current
+# order row o, whether its units go back into stock). The condition is part
+# of the UPDATE itself, so of two concurrent requests only one can move the
+# order; the other finds the condition false once the first commits and
+# changes nothing. A "return received" step would be one more entry here
+# with restock=True.
+ORDER_TRANSITIONS = {
+    'cancel': ('Cancelled',
+               "o.status NOT IN ('Cancelled', 'Return Requested') AND o.shipping_status IS DISTINCT FROM 'Delivered'",
+               True),
+    'request_return': ('Return Requested',
+                       "o.status NOT IN ('Cancelled', 'Return Requested')",
+                       False),
+}
+
+
+def transition_order(cursor, order_id, user_id, action):
+    """
+    Moves one of the user's orders to the action's status and, if the
+    action restocks, puts all of its items back into inventory, in a single
+    statement. Returns (found, changed): found is False when the order isn't
+    the user's, changed is False when it isn't in a state that allows it.
+    """
+    status, condition, restock = ORDER_TRANSITIONS[action]
+    restock_sql = ""
+    if restock:
+        # Inventory rows are locked in id order, as at checkout.
+        restock_sql = """,
+        returned AS (
+            SELECT oi.inventory_id, SUM(oi.quantity) AS quantity
+            FROM order_items oi JOIN changed ON oi.order_id = changed.id
+            GROUP BY oi.inventory_id),
+        locked AS MATERIALIZED (
+            SELECT i.id FROM inventory i JOIN returned ON returned.inventory_id = i.id ORDER BY i.id FOR UPDATE OF i),
+        restocked AS (
+            UPDATE inventory i SET stock_quantity = i.stock_quantity + returned.quantity
+            FROM returned JOIN locked ON locked.id = returned.inventory_id
+            WHERE i.id = returned.inventory_id
+            RETURNING i.id)"""
+    cursor.execute(f"""
+        WITH target AS (SELECT id FROM orders WHERE id = %s AND user_id = %s),
+        changed AS (
+            UPDATE orders o SET status = %s FROM target
+            WHERE o.id = target.id AND {condition}
+            RETURNING o.id){restock_sql}
+        SELECT EXISTS (SELECT 1 FROM target), EXISTS (SELECT 1 FROM changed)
+    """, (order_id, user_id, status))
+    found, changed = cursor.fetchone()
+    return found, changed
+
+
+@jobs.handler('order_placed')
+def after_order_placed(cursor, payload):
+    """
+    Background part of an order, run once it has committed: assign the
+    shipment's tracking number and status and count the co-purchases. An
+    order cancelled (or deleted) before the job ran gets neither; the row
+    lock keeps a concurrent cancel waiting until this job commits.
+    """
+    order_id = payload['order_id']
+    cursor.execute("SELECT status FROM orders WHERE id = %s FOR UPDATE", (order_id,))
+    row = cursor.fetchone()
+    if row is None or row[0] == 'Cancelled':
+        return
+    cursor.execute("UPDATE orders SET tracking_number = %s, shipping_status = %s WHERE id = %s AND tracking_number IS NULL",
+                   (f"AWB{random.randint(100000000, 999999999)}IN", random.choice(['Processing', 'Shipped']), order_id))
+    recommendations.record_order(cursor, order_id)
+
+
+def _order_history_key(key):
+    """The (order_date, id) a decoded cursor seeks past, or None (first page) when it's malformed."""
+    try:
+        order_date, order_id = key
+        if not isinstance(order_id, int) or isinstance(order_id, bool):
+            return None
+        return datetime.fromisoformat(order_date), order_id
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_order_history(conn, user_id, cursor_token=None, limit=10):
+    """
+    One page of the user's orders, newest first, each with its items
+    aggregated into ``order_products`` by the same query. Returns (orders,
+    next cursor token or None on the last page); pages seek past the last
+    (order_date, id) shown, so a deep page costs the same as the first.
+    """
+    seek = ""
+    params = [user_id]
+    key = _order_history_key(decode_cursor(cursor_token))
+    if key is not None:
+        seek = "AND (order_date, id) < (%s, %s)"
+        params += key
+    params.append(limit + 1)
+
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute(f"""
+        SELECT o.id, o.order_date AS date, o.total_price AS total, o.status, o.shipping_status,
+               COALESCE(json_agg(json_build_object('name', p.name, 'quantity', oi.quantity, 'price', oi.price,
+                                                   'order_item_id', oi.id, 'has_reviewed', oi.has_reviewed) ORDER BY oi.id)
+                        FILTER (WHERE oi.id IS NOT NULL), '[]') AS order_products
+        FROM (SELECT * FROM orders WHERE user_id = %s {seek} ORDER BY order_date DESC, id DESC LIMIT %s) o
+        LEFT JOIN order_items oi ON oi.order_id = o.id
+        LEFT JOIN products p ON p.id = oi.product_id
+        GROUP BY o.id, o.order_date, o.total_price, o.status, o.shipping_status
+        ORDER BY o.order_date DESC, o.id DESC
+    """, params)
+    orders = cursor.fetchall()
+    cursor.close()
+
+    if len(orders) > limit:
+        orders = orders[:limit]
+        return orders, encode_cursor([orders[-1]['date'].isoformat(), orders[-1]['id']])
+    return orders, None
+
+
+def fetch_order_details(conn, order_id, user_id):
+    """
+    The user's order with its shipping address and items (``order_items``)
+    in one query, or None when it isn't theirs.
+    """
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute("""
+        SELECT o.*, to_json(a) AS shipping_address,
+               COALESCE((SELECT json_agg(json_build_object('product_id', p.id, 'name', p.name, 'image_url', p.image_url,
+                                                           'quantity', oi.quantity, 'price_paid', oi.price, 'size', oi.size) ORDER BY oi.id)
+                         FROM order_items oi JOIN products p ON oi.product_id = p.id WHERE oi.order_id = o.id), '[]') AS order_items
+        FROM orders o LEFT JOIN addresses a ON a.id = o.shipping_address_id
+        WHERE o.id = %s AND o.user_id = %s
+    """, (order_id, user_id))
+    order = cursor.fetchone()
+    cursor.close()
+    return order
@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+from flask import render_template
+
+from catalog import on_refresh
+
+# Rendered pages kept per process. Keys include the catalog version, so old
+# entries simply stop being hit; they are also dropped on every catalog swap.
+PAGE_CACHE_SIZE = 32
+
+# Per-visitor parts of base.html. While a page is rendered for the cache these
+# render as the markers below and are filled in for each request afterwards.
+FLASH_HOLE = "<!--page-cache:flash-->"
+CART_COUNT_HOLE = "<!--page-cache:cart-count-->"
+
+
+class PageCache:
+    """A small thread-safe LRU of fully rendered page bodies."""
+
+    def __init__(self, size=PAGE_CACHE_SIZE):
+        self.size = size
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            body = self._pages.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def set(self, key, body):
+        with self._lock:
+            self._pages[key] = body
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+
+cache = PageCache()
+
+
+@on_refresh
+def _drop_stale_pages(old_snapshot, new_snapshot):
+    cache.clear()
+
+
+def _fill_holes(body, cart_item_count):
+    """Puts this visitor's flash messages and cart badge into a cached body."""
+    flashes = render_template('_flash_messages.html') if FLASH_HOLE in body else ''
+    badge = Markup('<span class="cart-count-badge">{}</span>').format(cart_item_count) if cart_item_count > 0 else ''
+    return body.replace(FLASH_HOLE, flashes).replace(CART_COUNT_HOLE, badge)
+
+
+def render_cached(key, cart_item_count, template_name, build_context):
+    """
+    render_template() for pages that look the same for every visitor apart
+    from the flash messages and the cart badge. ``key`` must capture
+    everything else the page depends on (e.g. the catalog version and whether
+    the visitor is signed in); ``build_context`` is only called on a miss.
+    """
+    body = cache.get(key)
+    if body is None:
+        body = render_template(template_name, page_cache_render=True, **build_context())
+        cache.set(key, body)
+    return _fill_holes(body, cart_item_count)
@@ -0,0 +1,29 @@
+import json
+import base64
+import binascii
+
+
+def encode_cursor(payload):
+    """Packs a keyset position (any JSON-able value) into an opaque, URL-safe token."""
+    raw = json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Reverses encode_cursor. Returns None for a missing or tampered token, i.e. 'first page'."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        return json.loads(raw.decode('utf-8'))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        return None
+
+
+def clamp_page_size(value, default, maximum):
+    """Parses a requested page size, falling back to default and never exceeding maximum."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
@@ -0,0 +1,211 @@
+import math
+import heapq
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+import psycopg2
+
+from db_pool import get_pool
+from catalog import get_catalog, on_refresh
+from change_feed import feed
+
+# Channel record_order() notifies on, with the ids of the products in the order.
+CO_PURCHASE_CHANNEL = "co_purchases_changed"
+
+# --- 1. TUNING ---
+# Neighbours kept per product; the product page shows the first four.
+TOP_N = 8
+# Points for sharing an attribute with the product being viewed.
+ATTRIBUTE_WEIGHTS = {'category': 1.0, 'brand': 0.6, 'color': 0.3}
+# Up to this many points for a similar price, falling to zero at PRICE_RANGE x apart.
+PRICE_WEIGHT = 0.5
+PRICE_RANGE = 2.0
+# Weight of log(1 + orders that contained both products). Three shared orders
+# (~1.4 points) outweigh a same-brand match; a dozen outweigh everything else.
+CO_PURCHASE_WEIGHT = 1.0
+
+
+# --- 2. SCORING ---
+def _features(product):
+    """The attributes a product is compared on, precomputed once per snapshot."""
+    return (product['category'], product['brand'], product['color'], math.log(max(product['sale_price'], 1.0)))
+
+
+def attribute_similarity(a, b):
+    """Similarity of two feature tuples from _features()."""
+    score = 0.0
+    for i, weight in enumerate(ATTRIBUTE_WEIGHTS.values()):
+        if a[i] is not None and a[i] == b[i]:
+            score += weight
+    return score + PRICE_WEIGHT * max(0.0, 1 - abs(a[3] - b[3]) / math.log(PRICE_RANGE))
+
+
+def _nearest(log_prices, ids, target, n):
+    """The n ids whose (sorted) log price is closest to target."""
+    right = bisect_left(log_prices, target)
+    left = right - 1
+    found = []
+    while len(found) < n and (left >= 0 or right < len(ids)):
+        if right >= len(ids) or (left >= 0 and target - log_prices[left] <= log_prices[right] - target):
+            found.append(ids[left])
+            left -= 1
+        else:
+            found.append(ids[right])
+            right += 1
+    return found
+
+
+# --- 3. NEIGHBOUR INDEX ---
+class RecommendationIndex:
+    """
+    Top-N "similar items" per product, blended from attribute similarity and
+    how often two products were bought in the same order.
+
+    Products are grouped into buckets of identical (category, brand, colour),
+    each sorted by price. Within a bucket the score only falls as the price
+    gap grows, so the best candidates from a bucket are its TOP_N nearest
+    prices, found by bisection. A product is therefore compared with a few
+    dozen candidates (its category's and brand's buckets, plus anything bought
+    alongside it) instead of the whole catalog. ``neighbors`` is replaced
+    wholesale (never mutated), which keeps lookups lock-free; a new order
+    re-ranks just the products in it.
+    """
+
+    def __init__(self):
+        self.neighbors = {}
+        self.co_counts = defaultdict(dict)
+        self.snapshot = None
+        self.catalog_version = None
+        self._features = {}
+        self._buckets = {}
+        self._buckets_by_category = {}
+        self._buckets_by_brand = {}
+        self._lock = threading.Lock()
+
+    def _rank(self, product_id):
+        snapshot = self.snapshot
+        product = snapshot.by_id[product_id]
+        partners = self.co_counts.get(product_id, {})
+        features = self._features[product_id]
+        candidates = {pid for pid in partners if pid in snapshot.by_id}
+        for key in self._buckets_by_category.get(product['category'], set()) | self._buckets_by_brand.get(product['brand'], set()):
+            log_prices, ids = self._buckets[key]
+            candidates.update(_nearest(log_prices, ids, features[3], TOP_N + 1))
+        candidates.discard(product_id)
+
+        scored = (
+            (attribute_similarity(features, self._features[pid]) + CO_PURCHASE_WEIGHT * math.log1p(partners.get(pid, 0)), -pid)
+            for pid in candidates
+        )
+        return tuple(-neg_id for _, neg_id in heapq.nlargest(TOP_N, scored))
+
+    def load_co_purchases(self, conn, product_ids=None):
+        """Reads co-purchase counts, for every product or only the given ones."""
+        cursor = conn.cursor()
+        if product_ids is None:
+            cursor.execute("SELECT product_id, other_product_id, orders_count FROM product_co_purchases")
+        else:
+            cursor.execute("SELECT product_id, other_product_id, orders_count FROM product_co_purchases WHERE product_id = ANY(%s)",
+                           (list(product_ids),))
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.rollback()
+        counts = defaultdict(dict)
+        for product_id, other_id, orders_count in rows:
+            counts[product_id][other_id] = orders_count
+        return counts
+
+    def build(self, snapshot, co_counts):
+        """Recomputes every product's neighbours against a catalog snapshot."""
+        with self._lock:
+            self.snapshot = snapshot
+            self.co_counts = co_counts
+            self._features = {p['id']: _features(p) for p in snapshot.products}
+            grouped = defaultdict(list)
+            for product_id, features in self._features.items():
+                grouped[features[:3]].append((features[3], product_id))
+            self._buckets, self._buckets_by_category, self._buckets_by_brand = {}, defaultdict(set), defaultdict(set)
+            for key, members in grouped.items():
+                members.sort()
+                self._buckets[key] = ([price for price, _ in members], [pid for _, pid in members])
+                self._buckets_by_category[key[0]].add(key)
+                self._buckets_by_brand[key[1]].add(key)
+            self.neighbors = {p['id']: self._rank(p['id']) for p in snapshot.products}
+            self.catalog_version = snapshot.version
+
+    def update(self, co_counts):
+        """Applies fresh counts for a few products and re-ranks only those."""
+        with self._lock:
+            if self.snapshot is None:
+                return
+            neighbors = dict(self.neighbors)
+            for product_id, partners in co_counts.items():
+                self.co_counts[product_id] = partners
+                if product_id in self.snapshot.by_id:
+                    neighbors[product_id] = self._rank(product_id)
+            self.neighbors = neighbors
+
+
+# --- 4. PROCESS-WIDE INDEX ---
+index = RecommendationIndex()
+
+
+def _rebuild(snapshot):
+    try:
+        with get_pool().connection() as conn:
+            co_counts = index.load_co_purchases(conn)
+    except psycopg2.Error as e:
+        # Attribute similarity alone is still a good answer.
+        print(f"--- RECOMMENDATIONS: co-purchase counts unavailable ({e}) ---")
+        co_counts = index.co_counts
+    index.build(snapshot, co_counts)
+
+
+@on_refresh
+def _sync_with_catalog(old_snapshot, new_snapshot):
+    _rebuild(new_snapshot)
+
+
+def _on_co_purchases_changed(payloads):
+    if payloads is None:
+        # (Re)connected: anything could have changed while we weren't listening.
+        _rebuild(get_catalog())
+        return
+    product_ids = {int(pid) for payload in payloads for pid in payload.split(',') if pid}
+    with get_pool().connection() as conn:
+        co_counts = index.load_co_purchases(conn, product_ids)
+    index.update({pid: co_counts.get(pid, {}) for pid in product_ids})
+
+
+feed.subscribe(CO_PURCHASE_CHANNEL, _on_co_purchases_changed)
+
+
+def similar_products(product_id, limit=4):
+    """Up to ``limit`` products to recommend alongside product_id, best first."""
+    catalog = get_catalog()
+    if index.catalog_version != catalog.version:
+        _rebuild(catalog)
+    return [catalog.by_id[pid] for pid in index.neighbors.get(product_id, ())[:limit] if pid in catalog.by_id]
+
+
+# --- 5. WRITE SIDE ---
+def record_order(cursor, order_id):
+    """
+    Adds an order's product pairs to product_co_purchases. Call it in the same
+    transaction that inserted the order items; every worker re-ranks the
+    affected products when the transaction commits. Pair rows are upserted,
+    and so locked, in key order, so two orders sharing products can't deadlock.
+    """
+    cursor.execute("""
+        INSERT INTO product_co_purchases (product_id, other_product_id, orders_count)
+        SELECT DISTINCT a.product_id, b.product_id, 1
+        FROM order_items a JOIN order_items b ON a.order_id = b.order_id AND a.product_id <> b.product_id
+        WHERE a.order_id = %s
+        ORDER BY 1, 2
+        ON CONFLICT (product_id, other_product_id) DO UPDATE SET orders_count = product_co_purchases.orders_count + 1
+        RETURNING product_id
+    """, (order_id,))
+    product_ids = sorted({row[0] for row in cursor.fetchall()})
+    if product_ids:
+        cursor.execute("SELECT pg_notify(%s, %s)", (CO_PURCHASE_CHANNEL, ','.join(str(pid) for pid in product_ids)))
+    return product_ids
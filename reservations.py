@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+import argparse
+import psycopg2
+from dotenv import load_dotenv
+
+from db_pool import get_pool
+from cart_pricing import parse_cart
+
+# --- 1. SETTINGS ---
+# How long a cart line keeps its units out of everyone else's reach.
+HOLD_TTL_MINUTES = int(os.getenv("HOLD_TTL_MINUTES", "15"))
+# How often (seconds) each worker's sweeper releases expired holds, and how
+# many it releases per statement.
+SWEEP_INTERVAL = float(os.getenv("HOLD_SWEEP_INTERVAL", "60"))
+SWEEP_BATCH = 500
+
+# Every function here takes a cursor and joins the caller's transaction. Hold
+# rows are always locked before the inventory rows they reserve, and several
+# inventory rows are always locked in id order (lock_sizes(), the sweeper and
+# checkout), so none of them can deadlock with another.
+
+
+# --- 2. HOLDS ---
+def hold(cursor, cart_id, product_id, inventory_id, quantity):
+    """
+    Sets the cart's hold on one size to ``quantity`` units (0 releases it) and
+    renews its expiry. Only the difference from the current hold is taken
+    from, or given back to, inventory.available_quantity, in one conditional
+    update. Returns (ok, available): ok is False when there aren't enough
+    units left, and None when the size doesn't belong to the product; the
+    caller must then roll back.
+    """
+    quantity = max(quantity, 0)
+    # Creating the hold row up front (or locking the existing one) serialises
+    # concurrent changes to the same cart line, e.g. a double-clicked button.
+    cursor.execute("""
+        INSERT INTO inventory_holds AS h (cart_id, inventory_id, quantity, expires_at) VALUES (%s, %s, 0, NOW())
+        ON CONFLICT (cart_id, inventory_id) DO UPDATE SET quantity = h.quantity
+        RETURNING quantity
+    """, (cart_id, inventory_id))
+    held = cursor.fetchone()[0]
+    delta = quantity - held
+    cursor.execute("""
+        UPDATE inventory SET reserved_quantity = reserved_quantity + %s
+        WHERE id = %s AND product_id = %s AND (%s <= 0 OR available_quantity >= %s)
+        RETURNING available_quantity
+    """, (delta, inventory_id, product_id, delta, delta))
+    updated = cursor.fetchone()
+    if updated is None:
+        cursor.execute("SELECT available_quantity FROM inventory WHERE id = %s AND product_id = %s", (inventory_id, product_id))
+        current = cursor.fetchone()
+        return (None, 0) if current is None else (False, max(current[0], 0) + held)
+    if quantity > 0:
+        cursor.execute("""
+            INSERT INTO inventory_holds (cart_id, inventory_id, quantity, expires_at) VALUES (%s, %s, %s, NOW() + %s * INTERVAL '1 minute')
+            ON CONFLICT (cart_id, inventory_id) DO UPDATE SET quantity = EXCLUDED.quantity, expires_at = EXCLUDED.expires_at
+        """, (cart_id, inventory_id, quantity, HOLD_TTL_MINUTES))
+    else:
+        cursor.execute("DELETE FROM inventory_holds WHERE cart_id = %s AND inventory_id = %s", (cart_id, inventory_id))
+    return True, updated[0]
+
+
+def lock_sizes(cursor, cart_id, inventory_ids):
+    """
+    Locks the cart's existing holds on several sizes, then those sizes'
+    inventory rows, each in id order. Call it before changing more than one
+    hold in a transaction; hold() on its own only locks one of each.
+    """
+    ids = sorted(set(inventory_ids))
+    cursor.execute("SELECT 1 FROM inventory_holds WHERE cart_id = %s AND inventory_id = ANY(%s) ORDER BY inventory_id FOR UPDATE",
+                   (cart_id, ids))
+    cursor.execute("SELECT 1 FROM inventory WHERE id = ANY(%s) ORDER BY id FOR UPDATE", (ids,))
+
+
+def take_holds(cursor, cart_id):
+    """
+    Deletes every hold of the cart and returns {inventory_id: quantity}. The
+    caller must give the units back to inventory in the same transaction
+    (orders.decrement_stock does, when it converts them into a sale).
+    """
+    if cart_id is None:
+        return {}
+    cursor.execute("DELETE FROM inventory_holds WHERE cart_id = %s RETURNING inventory_id, quantity", (cart_id,))
+    return {inventory_id: quantity for inventory_id, quantity in cursor.fetchall()}
+
+
+def move_holds(cursor, from_cart_id, to_cart_id, items):
+    """
+    Hands one cart's holds to another (the login merge), then sets each of
+    its holds to the line's quantity in the merged cart ``items``. Merging
+    caps lines (cart_store.merge_items), so adding up the two holds could
+    reserve more units than the cart contains.
+    """
+    cursor.execute("""
+        WITH moved AS (DELETE FROM inventory_holds WHERE cart_id = %s RETURNING inventory_id, quantity, expires_at)
+        INSERT INTO inventory_holds (cart_id, inventory_id, quantity, expires_at)
+        SELECT %s, inventory_id, quantity, expires_at FROM moved ORDER BY inventory_id
+        ON CONFLICT (cart_id, inventory_id) DO UPDATE SET quantity = inventory_holds.quantity + EXCLUDED.quantity,
+            expires_at = GREATEST(inventory_holds.expires_at, EXCLUDED.expires_at)
+    """, (from_cart_id, to_cart_id))
+    lines = sorted(parse_cart(items), key=lambda entry: entry[2])
+    lock_sizes(cursor, to_cart_id, [inventory_id for _, _, inventory_id, _ in lines])
+    for _, product_id, inventory_id, quantity in lines:
+        # Lowering a hold always succeeds; a line whose hold had expired keeps
+        # whatever is still available, and checkout re-checks stock anyway.
+        hold(cursor, to_cart_id, product_id, inventory_id, quantity)
+
+
+# --- 3. SWEEPER ---
+def release_expired(cursor, limit=SWEEP_BATCH):
+    """
+    Releases up to ``limit`` expired holds in one statement and returns how
+    many. Holds being changed right now are skipped, not waited for, so
+    several workers can sweep at once; inventory rows are locked in id
+    order, as at checkout.
+    """
+    cursor.execute("""
+        WITH expired AS (
+            DELETE FROM inventory_holds WHERE (cart_id, inventory_id) IN (
+                SELECT cart_id, inventory_id FROM inventory_holds WHERE expires_at < NOW()
+                ORDER BY inventory_id LIMIT %s FOR UPDATE SKIP LOCKED)
+            RETURNING inventory_id, quantity),
+        totals AS (SELECT inventory_id, SUM(quantity) AS quantity, COUNT(*) AS holds FROM expired GROUP BY inventory_id),
+        locked AS MATERIALIZED (
+            SELECT i.id FROM inventory i JOIN totals ON totals.inventory_id = i.id ORDER BY i.id FOR UPDATE OF i),
+        released AS (
+            UPDATE inventory i SET reserved_quantity = i.reserved_quantity - totals.quantity
+            FROM totals JOIN locked ON locked.id = totals.inventory_id
+            WHERE i.id = totals.inventory_id
+            RETURNING totals.holds)
+        SELECT COALESCE(SUM(holds), 0) FROM released
+    """, (limit,))
+    return cursor.fetchone()[0]
+
+
+def sweep(conn):
+    """Releases every expired hold, a batch per transaction. Returns the number released."""
+    total = 0
+    cursor = conn.cursor()
+    try:
+        while True:
+            released = release_expired(cursor)
+            conn.commit()
+            total += released
+            if released < SWEEP_BATCH:
+                return total
+    finally:
+        cursor.close()
+
+
+def run_sweeper():
+    """Blocking loop; start it with socketio.start_background_task like the change feed."""
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        try:
+            with get_pool().connection() as conn:
+                released = sweep(conn)
+            if released:
+                print(f"[holds] released {released} expired hold(s)")
+        except psycopg2.Error as e:
+            print(f"--- HOLD SWEEPER: sweep failed ({e}); retrying in {SWEEP_INTERVAL:.0f}s ---")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Release expired cart inventory holds once (e.g. from cron).")
+    parser.parse_args(argv)
+    load_dotenv()
+    with get_pool().connection() as conn:
+        print(f"Released {sweep(conn)} expired hold(s).")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+from datetime import datetime
+import psycopg2.extras
+
+from pagination import encode_cursor, decode_cursor
+
+# --- 1. SORT MODES ---
+# (ORDER BY, seek predicate, key columns) per sort mode. Every order ends with
+# the review id so it is total, which lets the next page start strictly after
+# the last review shown (keyset pagination) instead of skipping OFFSET rows.
+# 'lowest' mixes directions (rating up, date down), so its predicate is
+# spelled out instead of a single row comparison.
+REVIEW_SORTS = {
+    'newest': ("ORDER BY r.review_date DESC, r.id DESC",
+               "(r.review_date, r.id) < (%s::timestamp, %s)",
+               ('review_date', 'id')),
+    'oldest': ("ORDER BY r.review_date ASC, r.id ASC",
+               "(r.review_date, r.id) > (%s::timestamp, %s)",
+               ('review_date', 'id')),
+    'highest': ("ORDER BY r.rating DESC, r.review_date DESC, r.id DESC",
+                "(r.rating, r.review_date, r.id) < (%s, %s::timestamp, %s)",
+                ('rating', 'review_date', 'id')),
+    'lowest': ("ORDER BY r.rating ASC, r.review_date DESC, r.id DESC",
+               "(r.rating > %s OR (r.rating = %s AND (r.review_date, r.id) < (%s::timestamp, %s)))",
+               ('rating', 'rating', 'review_date', 'id')),
+}
+DEFAULT_SORT = 'newest'
+
+
+def _key_of(row, sort_by):
+    """The cursor key of a review row: its sort columns, JSON-friendly."""
+    columns = dict.fromkeys(REVIEW_SORTS[sort_by][2])
+    return [row[c].isoformat() if isinstance(row[c], datetime) else row[c] for c in columns]
+
+
+def _seek_params(key, sort_by):
+    """
+    The seek predicate's parameters for a cursor key, or None when the key
+    isn't one _key_of could have produced (tampered or stale), so that the
+    caller serves the first page instead of sending bad values to SQL.
+    """
+    columns = list(dict.fromkeys(REVIEW_SORTS[sort_by][2]))
+    if not isinstance(key, list) or len(key) != len(columns):
+        return None
+    values = dict(zip(columns, key))
+    try:
+        datetime.fromisoformat(values['review_date'])
+    except (TypeError, ValueError):
+        return None
+    if any(not isinstance(values[c], int) or isinstance(values[c], bool) for c in columns if c != 'review_date'):
+        return None
+    return [values[c] for c in REVIEW_SORTS[sort_by][2]]
+
+
+def fetch_reviews(conn, product_id, sort_by=DEFAULT_SORT, cursor_token=None, limit=4):
+    """
+    One page of a product's reviews. Returns (reviews, next cursor token or
+    None on the last page). Every page is an index seek plus ``limit`` rows,
+    however deep it is, and pages don't shift when new reviews arrive.
+    """
+    if sort_by not in REVIEW_SORTS:
+        sort_by = DEFAULT_SORT
+    order_clause, seek_clause, _ = REVIEW_SORTS[sort_by]
+    cursor_data = decode_cursor(cursor_token)
+    key = cursor_data.get('k') if isinstance(cursor_data, dict) and cursor_data.get('s') == sort_by else None
+    seek_params = _seek_params(key, sort_by)
+
+    where = "r.product_id = %s"
+    params = [product_id]
+    if seek_params is not None:
+        where += " AND " + seek_clause
+        params += seek_params
+    params.append(limit + 1)
+
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute(f"""
+        SELECT r.id, r.rating, r.comment, r.review_date, u.username
+        FROM reviews r JOIN users u ON r.user_id = u.id
+        WHERE {where} {order_clause} LIMIT %s
+    """, params)
+    rows = cursor.fetchall()
+    cursor.close()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor({'s': sort_by, 'k': _key_of(rows[-1], sort_by)})
+    return rows, None
+
+
+# --- 2. RATING AGGREGATES ---
+STAR_VALUES = (5, 4, 3, 2, 1)
+
+
+def record_rating(cursor, product_id, rating):
+    """
+    Adds one rating to the product's running aggregates and refreshes
+    products.rating / num_ratings from them. Call it in the same transaction
+    as the review insert: the upsert row-locks the product's aggregate, so
+    concurrent reviews of one product are applied one after another and the
+    totals never drift from the reviews table.
+    """
+    star_column = f"stars_{int(rating)}"
+    cursor.execute(f"""
+        INSERT INTO product_rating_stats AS s (product_id, rating_sum, rating_count, {star_column})
+        VALUES (%s, %s, 1, 1)
+        ON CONFLICT (product_id) DO UPDATE SET rating_sum = s.rating_sum + EXCLUDED.rating_sum,
+            rating_count = s.rating_count + 1, {star_column} = s.{star_column} + 1
+        RETURNING rating_sum, rating_count
+    """, (product_id, rating))
+    rating_sum, rating_count = cursor.fetchone()
+    cursor.execute("UPDATE products SET rating = ROUND(%s::numeric / %s, 1), num_ratings = %s WHERE id = %s",
+                   (rating_sum, rating_count, rating_count, product_id))
+
+
+def fetch_rating_breakdown(conn, product_id):
+    """
+    The product's star histogram, 5 stars first: a list of dicts with
+    stars, count and percent (of all its ratings). Empty when it has none.
+    """
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute("SELECT rating_count, stars_1, stars_2, stars_3, stars_4, stars_5 FROM product_rating_stats WHERE product_id = %s", (product_id,))
+    stats = cursor.fetchone()
+    cursor.close()
+    if stats is None or not stats['rating_count']:
+        return []
+    total = stats['rating_count']
+    return [dict(stars=n, count=stats[f'stars_{n}'], percent=round(100 * stats[f'stars_{n}'] / total)) for n in STAR_VALUES]
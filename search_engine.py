@@ -0,0 +1,232 @@
+import re
+import math
+import threading
+import unicodedata
+from collections import defaultdict
+
+from catalog import get_catalog, on_refresh
+
+# --- 1. TUNING ---
+# How much a match in each product field is worth.
+FIELD_WEIGHTS = {'name': 3.0, 'brand': 2.0, 'category': 1.5, 'color': 1.0}
+# Match quality multipliers: a typo is worth less than a prefix, which is worth less than an exact term.
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.8
+FUZZY_MATCH = 0.5
+# Shortest prefix we index (edge n-grams of 2..len(term) characters).
+MIN_PREFIX = 2
+# How strongly popularity (rating x log(num_ratings)) lifts a relevant result.
+POPULARITY_WEIGHT = 0.15
+# Cached results per catalog version; keystroke searches repeat a lot.
+RESULT_CACHE_SIZE = 512
+
+# Connectives only; gender words like 'men' are real queries ("mens shirt").
+STOP_WORDS = {'and', 'with', 'the', 'a', 'an', 'of', 'for', 'in'}
+
+
+# --- 2. TEXT NORMALISATION ---
+def _stem(token):
+    """A deliberately tiny plural stemmer; applied to documents and queries alike."""
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith(('sses', 'shes', 'ches', 'xes', 'zes')):
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text, keep_stop_words=False):
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text).lower()
+    # "T-Shirt", "t shirt" and "tshirts" should all meet at the same term.
+    text = re.sub(r"\bt[\s-]?shirts?\b", "tshirt", text)
+    tokens = re.findall(r"[a-z0-9]+", text)
+    return [_stem(t) for t in tokens if (keep_stop_words or t not in STOP_WORDS) and len(t) > 1]
+
+
+def query_tokens(query):
+    """The words a query is searched by; one made only of stop words is still searched, word for word."""
+    return tokenize(query) or tokenize(query, keep_stop_words=True)
+
+
+def bounded_edit_distance(a, b, limit):
+    """
+    Edit distance between a and b counting an adjacent swap ("jaens") as one
+    edit, or limit + 1 as soon as the distance must exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if before_previous is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+    return previous[-1]
+
+
+def typo_budget(token):
+    """Edits tolerated for a query token: none for short ones, where a typo is another word."""
+    if len(token) < 4:
+        return 0
+    return 1 if len(token) < 8 else 2
+
+
+# --- 3. INVERTED INDEX ---
+class SearchIndex:
+    """
+    Inverted index over product name, brand, category and colour.
+
+    ``postings`` maps a term to {product_id: field weight}; ``prefixes`` maps every
+    edge n-gram of a term to the terms it starts, so a half-typed word is one
+    dictionary lookup. Terms are also bucketed by length so typo tolerance only
+    compares a query token against terms that could be within its edit budget.
+    Products are added, replaced and removed one at a time, which keeps a
+    catalog refresh proportional to what actually changed.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.prefixes = defaultdict(set)
+        self.terms_by_length = defaultdict(set)
+        self.doc_terms = {}
+        self.popularity = {}
+        self.versions = {}
+        self.catalog_version = None
+        self._lock = threading.RLock()
+        self._cache = {}
+
+    def _add_term(self, term):
+        self.terms_by_length[len(term)].add(term)
+        for n in range(MIN_PREFIX, len(term) + 1):
+            self.prefixes[term[:n]].add(term)
+
+    def _drop_term(self, term):
+        self.terms_by_length[len(term)].discard(term)
+        for n in range(MIN_PREFIX, len(term) + 1):
+            bucket = self.prefixes.get(term[:n])
+            if bucket is not None:
+                bucket.discard(term)
+                if not bucket:
+                    del self.prefixes[term[:n]]
+
+    def add(self, product, version=None):
+        with self._lock:
+            self.remove(product['id'])
+            weights = {}
+            for field, field_weight in FIELD_WEIGHTS.items():
+                for term in tokenize(product.get(field)):
+                    weights[term] = max(weights.get(term, 0.0), field_weight)
+            for term, weight in weights.items():
+                if term not in self.postings:
+                    self._add_term(term)
+                self.postings[term][product['id']] = weight
+            self.doc_terms[product['id']] = weights
+            rating = float(product.get('rating') or 0)
+            self.popularity[product['id']] = (rating / 5.0) * math.log1p(product.get('num_ratings') or 0)
+            self.versions[product['id']] = version
+            self._cache.clear()
+
+    def remove(self, product_id):
+        with self._lock:
+            weights = self.doc_terms.pop(product_id, None)
+            if weights is None:
+                return
+            for term in weights:
+                docs = self.postings.get(term)
+                if docs is None:
+                    continue
+                docs.pop(product_id, None)
+                if not docs:
+                    del self.postings[term]
+                    self._drop_term(term)
+            self.popularity.pop(product_id, None)
+            self.versions.pop(product_id, None)
+            self._cache.clear()
+
+    def _expand(self, token, is_last):
+        """Returns {term: match quality} for everything a query token may refer to."""
+        matches = {}
+        if token in self.postings:
+            matches[token] = EXACT_MATCH
+        # Only the word being typed is treated as a prefix; earlier words are complete.
+        if is_last:
+            for term in self.prefixes.get(token, ()):
+                if term != token:
+                    matches.setdefault(term, PREFIX_MATCH * len(token) / len(term))
+        if not matches:
+            budget = typo_budget(token)
+            for length in range(len(token) - budget, len(token) + budget + 1):
+                for term in self.terms_by_length.get(length, ()):
+                    distance = bounded_edit_distance(token, term, budget)
+                    if distance <= budget:
+                        matches[term] = max(matches.get(term, 0.0), FUZZY_MATCH / distance)
+        return matches
+
+    def search(self, query, limit=None):
+        """Returns product ids matching every query word, best first."""
+        tokens = query_tokens(query)
+        if not tokens:
+            return []
+        key = (tuple(tokens), limit)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+
+            scores = None
+            for i, token in enumerate(tokens):
+                token_scores = {}
+                for term, quality in self._expand(token, i == len(tokens) - 1).items():
+                    for product_id, weight in self.postings[term].items():
+                        token_scores[product_id] = max(token_scores.get(product_id, 0.0), weight * quality)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pid: score + token_scores[pid] for pid, score in scores.items() if pid in token_scores}
+                if not scores:
+                    break
+
+            ranked = sorted(
+                (scores or {}).items(),
+                key=lambda item: (-item[1] * (1 + POPULARITY_WEIGHT * self.popularity.get(item[0], 0.0)), item[0]),
+            )
+            result = [pid for pid, _ in (ranked[:limit] if limit else ranked)]
+            if len(self._cache) >= RESULT_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[key] = result
+            return result
+
+    def sync(self, snapshot):
+        """Brings the index in line with a catalog snapshot, touching only changed products."""
+        with self._lock:
+            for product_id in [pid for pid in self.versions if pid not in snapshot.by_id]:
+                self.remove(product_id)
+            for product_id, version in snapshot.product_versions.items():
+                if self.versions.get(product_id) != version or product_id not in self.doc_terms:
+                    self.add(snapshot.by_id[product_id], version)
+            self.catalog_version = snapshot.version
+
+
+# --- 4. PROCESS-WIDE INDEX ---
+index = SearchIndex()
+
+
+@on_refresh
+def _sync_with_catalog(old_snapshot, new_snapshot):
+    index.sync(new_snapshot)
+
+
+def search(query, limit=None):
+    """Searches the current catalog; returns product mappings, best match first."""
+    catalog = get_catalog()
+    if index.catalog_version != catalog.version:
+        index.sync(catalog)
+    return [catalog.by_id[pid] for pid in index.search(query, limit) if pid in catalog.by_id]
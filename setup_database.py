@@ -1,4 +1,6 @@
-import os
+import sys
+import time
+import argparse
 import psycopg2
 import psycopg2.extras
 from dotenv import load_dotenv
@@ -6,6 +8,9 @@ from werkzeug.security import generate_password_hash
 from datetime import datetime, timedelta
 import random
 
+from db_pool import resolve_database_url
+from migrations import migrate
+
 # --- 1. SETUP ---
 load_dotenv()
 
@@ -14,7 +19,7 @@ INR_EXCHANGE_RATE = 83.50
 
 def get_db_connection():
     """Establishes a connection to the PostgreSQL database."""
-    conn = psycopg2.connect(os.getenv("DATABASE_URL"))
+    conn = psycopg2.connect(resolve_database_url())
     return conn
 
 def get_brand_for_product(name):
@@ -78,36 +83,45 @@ def create_dedicated_test_user(cursor):
     else:
         print(f"User '{username}' already exists. Skipping creation.")
 
-def setup_database():
+def reset_schema(cursor):
+    """Drops every application table, including the migration history, for a clean reseed."""
+    print("Dropping old tables if they exist...")
+    for table in ["reviews", "order_items", "orders", "inventory", "addresses", "products", "users", "wishlist", "product_co_purchases", "product_rating_stats", "carts", "inventory_holds", "jobs", "schema_migrations"]:
+        cursor.execute(f"DROP TABLE IF EXISTS {table} CASCADE;")
+    print("Old tables dropped.")
+
+def setup_database(reset=False):
+    """
+    Seeds the demo catalog, users and reviews. Never runs on container boot; it
+    is an explicit command. Without reset=True it refuses to touch a database
+    that already has products, so running it twice can't wipe real data.
+    """
+    started = time.perf_counter()
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    print("Dropping old tables if they exist...")
-    cursor.execute("DROP TABLE IF EXISTS reviews CASCADE;")
-    cursor.execute("DROP TABLE IF EXISTS order_items CASCADE;")
-    cursor.execute("DROP TABLE IF EXISTS orders CASCADE;")
-    cursor.execute("DROP TABLE IF EXISTS inventory CASCADE;")
-    cursor.execute("DROP TABLE IF EXISTS addresses CASCADE;")
-    cursor.execute("DROP TABLE IF EXISTS products CASCADE;")
-    cursor.execute("DROP TABLE IF EXISTS users CASCADE;")
-    cursor.execute("DROP TABLE IF EXISTS wishlist CASCADE;")
-    print("Old tables dropped.")
+    if reset:
+        reset_schema(cursor)
+        conn.commit()
+    cursor.close()
+
+    print("Applying schema migrations...")
+    migrate(conn)
+    cursor = conn.cursor()
 
-    print("Creating new tables with PostgreSQL schema...")
-    cursor.execute("""CREATE TABLE products (id INT PRIMARY KEY, name TEXT NOT NULL, description TEXT, long_description TEXT, original_price NUMERIC(10, 2) NOT NULL, discount_percent INTEGER NOT NULL DEFAULT 0, image_url TEXT, category TEXT, brand TEXT, color TEXT, rating NUMERIC(3, 1), num_ratings INTEGER NOT NULL DEFAULT 0);""")
-    cursor.execute("""CREATE TABLE inventory (id SERIAL PRIMARY KEY, product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE, size TEXT NOT NULL, stock_quantity INTEGER NOT NULL, UNIQUE(product_id, size));""")
-    cursor.execute("""CREATE TABLE users (id SERIAL PRIMARY KEY, username TEXT UNIQUE NOT NULL, email TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL, first_name TEXT NOT NULL, last_name TEXT NOT NULL, phone TEXT NOT NULL);""")
-    cursor.execute("""CREATE TABLE addresses (id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, address TEXT NOT NULL, city TEXT NOT NULL, state TEXT NOT NULL, zip_code TEXT NOT NULL, is_default BOOLEAN NOT NULL DEFAULT FALSE);""")
-    cursor.execute("""CREATE TABLE orders (id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, shipping_address_id INTEGER NOT NULL REFERENCES addresses(id), payment_method TEXT NOT NULL, payment_details TEXT, order_date TIMESTAMP NOT NULL, total_price NUMERIC(10, 2) NOT NULL, status TEXT DEFAULT 'Completed', tracking_number TEXT, shipping_status TEXT);""")
-    cursor.execute("""CREATE TABLE order_items (id SERIAL PRIMARY KEY, order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE, product_id INTEGER NOT NULL REFERENCES products(id), inventory_id INTEGER NOT NULL REFERENCES inventory(id), size TEXT NOT NULL, quantity INTEGER NOT NULL, price NUMERIC(10, 2) NOT NULL, has_reviewed BOOLEAN NOT NULL DEFAULT FALSE);""")
-    cursor.execute("""CREATE TABLE reviews (id SERIAL PRIMARY KEY, product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, rating INTEGER NOT NULL, comment TEXT NOT NULL, review_date TIMESTAMP NOT NULL);""")
-    cursor.execute("""CREATE TABLE wishlist (id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, product_id INTEGER NOT NULL REFERENCES products(id), added_date TIMESTAMP NOT NULL, UNIQUE(user_id, product_id));""")
-    print("All tables recreated successfully.")
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM products)")
+    if cursor.fetchone()[0]:
+        print("Database already contains products; skipping seed. Pass --reset to wipe and reseed.")
+        cursor.close()
+        conn.close()
+        return False
 
     products = [
         {"id": 1, "name": "Men’s black Graphic Print Slim Fit Crew-Neck T-Shirt", "category": "Tops", "color": "Black"}, {"id": 2, "name": "Men’s black graphic t-shirt, casual fit", "category": "Tops", "color": "Black"}, {"id": 3, "name": "Men’s white graphic t-shirt, relaxed fit", "category": "Tops", "color": "White"}, {"id": 4, "name": "Men’s grey plain t-shirt, slim fit", "category": "Tops", "color": "Grey"}, {"id": 5, "name": "Men’s classic fit polo shirt, navy blue", "category": "Tops", "color": "Navy Blue"}, {"id": 6, "name": "Men’s slim fit polo shirt, white", "category": "Tops", "color": "White"}, {"id": 7, "name": "Men’s blue casual button-down shirt, long sleeve", "category": "Tops", "color": "Blue"}, {"id": 8, "name": "Men’s white formal button-down shirt, long sleeve", "category": "Tops", "color": "White"}, {"id": 9, "name": "Men’s long sleeve henley shirt, charcoal grey", "category": "Tops", "color": "Charcoal Grey"}, {"id": 10, "name": "Men’s short sleeve henley shirt, olive green", "category": "Tops", "color": "Olive Green"}, {"id": 11, "name": "Men’s black tank top, athletic fit", "category": "Tops", "color": "Black"}, {"id": 12, "name": "Men’s white tank top, athletic fit", "category": "Tops", "color": "White"}, {"id": 13, "name": "Men’s grey crew neck sweater, knit", "category": "Tops", "color": "Grey"}, {"id": 14, "name": "Men’s navy v-neck sweater, knit", "category": "Tops", "color": "Navy"}, {"id": 15, "name": "Men’s logo print sweatshirt, black", "category": "Tops", "color": "Black"}, {"id": 16, "name": "Men’s plain sweatshirt, heather grey", "category": "Tops", "color": "Heather Grey"}, {"id": 17, "name": "Men’s red plaid flannel shirt, long sleeve", "category": "Tops", "color": "Red"}, {"id": 18, "name": "Men’s beige linen shirt, long sleeve", "category": "Tops", "color": "Beige"}, {"id": 19, "name": "Men’s short sleeve tropical print shirt, colorful", "category": "Tops", "color": "Multi-color"}, {"id": 20, "name": "Men’s striped rugby shirt, navy and white, long sleeve", "category": "Tops", "color": "Navy/White"}, {"id": 21, "name": "Men’s skinny jeans, dark wash", "category": "Bottoms", "color": "Dark Wash"}, {"id": 22, "name": "Men’s straight jeans, light wash", "category": "Bottoms", "color": "Light Wash"}, {"id": 23, "name": "Men’s slim fit jeans, black", "category": "Bottoms", "color": "Black"}, {"id": 24, "name": "Men’s khaki chinos, classic fit", "category": "Bottoms", "color": "Khaki"}, {"id": 25, "name": "Men’s olive chinos, slim fit", "category": "Bottoms", "color": "Olive"}, {"id": 26, "name": "Men’s grey joggers, drawstring waist", "category": "Bottoms", "color": "Grey"}, {"id": 27, "name": "Men’s black joggers, tapered fit", "category": "Bottoms", "color": "Black"}, {"id": 28, "name": "Men’s green cargo pants, multiple pockets", "category": "Bottoms", "color": "Green"}, {"id": 29, "name": "Men’s navy dress trousers, tailored fit", "category": "Bottoms", "color": "Navy"}, {"id": 30, "name": "Men’s blue denim shorts, casual fit", "category": "Bottoms", "color": "Blue"}, {"id": 31, "name": "Men’s beige chino shorts, classic fit", "category": "Bottoms", "color": "Beige"}, {"id": 32, "name": "Men’s black athletic shorts, moisture-wicking", "category": "Bottoms", "color": "Black"}, {"id": 33, "name": "Men’s navy athletic shorts, lightweight", "category": "Bottoms", "color": "Navy"}, {"id": 34, "name": "Men’s charcoal sweatpants, relaxed fit", "category": "Bottoms", "color": "Charcoal"}, {"id": 35, "name": "Men’s blue denim jacket, classic fit", "category": "Outerwear", "color": "Blue"}, {"id": 36, "name": "Men’s black bomber jacket, zip-up", "category": "Outerwear", "color": "Black"}, {"id": 37, "name": "Men’s brown leather jacket, biker style", "category": "Outerwear", "color": "Brown"}, {"id": 38, "name": "Men’s camel trench coat, belted", "category": "Outerwear", "color": "Camel"}, {"id": 39, "name": "Men’s navy puffer jacket, quilted", "category": "Outerwear", "color": "Navy"}, {"id": 40, "name": "Men’s grey zip-up hoodie, casual fit", "category": "Outerwear", "color": "Grey"}, {"id": 41, "name": "Men’s black pullover hoodie, classic fit", "category": "Outerwear", "color": "Black"}, {"id": 42, "name": "Men’s charcoal blazer, tailored fit", "category": "Outerwear", "color": "Charcoal"}, {"id": 43, "name": "Men’s black compression shirt, short sleeve", "category": "Activewear", "color": "Black"}, {"id": 44, "name": "Men’s white compression shirt, long sleeve", "category": "Activewear", "color": "White"}, {"id": 45, "name": "Men’s grey athletic tank top, moisture-wicking", "category": "Activewear", "color": "Grey"}, {"id": 46, "name": "Men’s blue running shorts, lightweight", "category": "Activewear", "color": "Blue"}, {"id": 47, "name": "Men’s black track jacket, zip-up", "category": "Activewear", "color": "Black"}, {"id": 48, "name": "Men’s navy workout t-shirt, moisture-wicking", "category": "Activewear", "color": "Navy"}, {"id": 49, "name": "Men’s black athletic leggings, fitted", "category": "Activewear", "color": "Black"}, {"id": 50, "name": "Men’s grey sleeveless hoodie, athletic fit", "category": "Activewear", "color": "Grey"},
     ]
     print(f"Populating {len(products)} products...")
+    product_rows = []
+    inventory_rows = []
     for product in products:
         name = product['name']
         brand = get_brand_for_product(name)
@@ -119,11 +133,15 @@ def setup_database():
         discount = random.choice([0, 0, 10, 15, 20, 25, 30, 40, 50])
         image_filename = f"{product['id']}.png"
         
-        cursor.execute("INSERT INTO products (id, name, description, long_description, original_price, discount_percent, image_url, category, brand, color, rating, num_ratings) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", (product['id'], name, short_desc, long_desc, original_price, discount, image_filename, product['category'], brand, product['color'], 0, 0))
+        product_rows.append((product['id'], name, short_desc, long_desc, original_price, discount, image_filename, product['category'], brand, product['color'], 0, 0))
         size_list = ["S", "M", "L", "XL", "XXL"] if product['category'] in ["Tops", "Outerwear", "Activewear"] else ["30", "32", "34", "36", "38"]
         for size in size_list:
             stock = random.choice([0, random.randint(5, 50)])
-            cursor.execute("INSERT INTO inventory (product_id, size, stock_quantity) VALUES (%s, %s, %s)", (product['id'], size, stock))
+            inventory_rows.append((product['id'], size, stock))
+    # One multi-row INSERT per table instead of a round trip per row. Inventory
+    # rows keep their order, so SERIAL ids match the per-row inserts of old.
+    psycopg2.extras.execute_values(cursor, "INSERT INTO products (id, name, description, long_description, original_price, discount_percent, image_url, category, brand, color, rating, num_ratings) VALUES %s", product_rows)
+    psycopg2.extras.execute_values(cursor, "INSERT INTO inventory (product_id, size, stock_quantity) VALUES %s", inventory_rows, page_size=1000)
     print(f"{len(products)} products and their inventory inserted.")
 
     users = [
@@ -140,23 +158,27 @@ def setup_database():
         (1, 5, "Absolutely fantastic t-shirt! The fit is perfect and the fabric is incredibly soft. A must-buy."), (1, 5, "My new favorite daily wear tee. Great print quality and doesn't shrink in the wash."), (1, 4, "Solid everyday shirt, the black color holds up well."), (2, 5, "Super comfortable and stylish. Excellent casual wear."), (2, 4, "Good material, relaxed fit is true to size."), (3, 5, "Love the minimalist design on this. The white is crisp and the fit is perfect for a relaxed look."), (3, 4, "Great quality tee, feels premium."), (4, 5, "Perfect basic T. Aura Basics lives up to its name. Five stars for simplicity and quality."), (4, 5, "Soft, great layering piece. Buying more colors."), (4, 5, "The slim fit is just right, not too restrictive."), (4, 4, "Great value for money. Highly recommend this staple."), (5, 5, "Classic polo that you can dress up or down. The navy blue is rich and the fabric has a nice texture."), (5, 4, "A sharp polo that works for the office or a casual weekend. Fit is very comfortable."), (6, 4, "A very clean and crisp white polo. The slim fit is modern and looks great."), (7, 5, "Amazing quality. Looks much more expensive than it is."), (7, 5, "Breathable and stylish. Perfect for warm weather."), (8, 4, "The essential white formal shirt. It's a bit stiff at first, but softens up after a wash. Great for the price."), (9, 5, "The charcoal grey is a versatile color. This henley is my new go-to for a smart-casual look."), (10, 4, "Very comfortable henley, nice olive color that's a bit different from the usual."), (11, 5, "Great for the gym. Breathes well and doesn't restrict movement at all."), (13, 5, "Excellent quality knit sweater, feels very premium and warm."), (14, 4, "A solid V-neck sweater. Good for layering over a shirt for the office."), (15, 5, "Warm, cozy, and the logo is subtle enough. Great for weekend lounging."), (16, 5, "Can't go wrong with a classic grey sweatshirt. This one is super soft inside."), (17, 3, "The colors are great, but the flannel is a bit thinner than I expected."), (18, 5, "Perfect linen shirt for a beach vacation. Lightweight and kept me cool."), (21, 5, "Best jeans I've bought in years. The dark wash is perfect and they have the perfect stretch."), (21, 4, "Stylish and comfortable. My go-to denim."), (21, 5, "Unbelievable fit. Feels custom-made."), (22, 3, "Decent quality, but the straight fit is a little baggier than I expected."), (23, 5, "Aura Denim nails it. These black jeans are a wardrobe staple. They don't fade after washing."), (24, 5, "Classic khaki chinos. The fit is perfect - not too tight, not too loose. Great for any occasion."), (26, 5, "The ultimate work-from-home pants. Soft interior and they look presentable for a coffee run."), (26, 5, "Incredible comfort. They wash and dry quickly without fading."), (26, 5, "Fantastic joggers, better than the big athletic brands."), (27, 5, "Best black joggers, super versatile and stylish for a sporty look."), (29, 4, "These are sharp. The tailored fit on these trousers is excellent. Aura Luxe is impressive."), (30, 4, "Good quality denim shorts, perfect for summer weekends."), (32, 5, "The moisture-wicking on these shorts is legit. Great for running or intense workouts."), (34, 4, "Very comfortable sweatpants for lounging around the house."), (35, 5, "A timeless piece. The blue wash is exactly what I was looking for. Perfect layering weight."), (35, 5, "This jacket feels like it will last a decade. Excellent craftsmanship from Aura Denim."), (35, 4, "Great jacket, slightly stiff but I expect it to break in nicely."), (36, 4, "Stylish and warm enough for a cool evening. Good slim profile."), (37, 2, "Looked great but the leather felt a bit stiff and the fit was too tight in the shoulders for me."), (39, 4, "Warm puffer jacket, great for winter commutes."), (40, 5, "Super soft interior fleece. My favorite hoodie now."), (41, 5, "A classic black hoodie. Can't go wrong. The material feels durable."), (42, 5, "Sharp fit. Aura Luxe delivered a perfect business-casual piece."), (43, 3, "It's a good compression shirt, but a bit restrictive for my workouts."), (45, 5, "Moisture-wicking works perfectly. Stays dry even during intense sessions."), (45, 5, "Lightest tank I own. Zero chafing."), (45, 5, "Perfect for the gym. The fit is athletic but comfortable."), (47, 4, "Sleek track jacket. Good for a morning run or just as a light layer."), (49, 5, "Great compression and support for leg day. Aura Active is top-notch."), (50, 4, "Good for lifting weights. Keeps me warm without overheating."),
     ]
     print(f"Creating {len(all_sample_reviews)} sample reviews...")
+    review_rows = []
     for review in all_sample_reviews:
         user_id_to_use = random.randint(1, len(users))
         review_date = (datetime.now() - timedelta(days=random.randint(1, 100)))
-        cursor.execute("INSERT INTO reviews (product_id, user_id, rating, comment, review_date) VALUES (%s, %s, %s, %s, %s)", (review[0], user_id_to_use, review[1], review[2], review_date))
+        review_rows.append((review[0], user_id_to_use, review[1], review[2], review_date))
+    psycopg2.extras.execute_values(cursor, "INSERT INTO reviews (product_id, user_id, rating, comment, review_date) VALUES %s", review_rows)
     print(f"{len(all_sample_reviews)} sample reviews created.")
     
-    print("Calculating and updating average ratings and counts...")
-    cursor.execute("SELECT id FROM products")
-    all_product_ids = cursor.fetchall()
-
-    for row in all_product_ids:
-        product_id = row[0]
-        cursor.execute("SELECT AVG(rating), COUNT(id) FROM reviews WHERE product_id = %s", (product_id,))
-        stats_data = cursor.fetchone()
-        avg_rating, rating_count = stats_data if stats_data else (0, 0)
-        if avg_rating is not None:
-             cursor.execute("UPDATE products SET rating = %s, num_ratings = %s WHERE id = %s", (round(float(avg_rating), 1), rating_count, product_id))
+    print("Calculating rating aggregates, average ratings and counts...")
+    cursor.execute("""
+        INSERT INTO product_rating_stats (product_id, rating_sum, rating_count, stars_1, stars_2, stars_3, stars_4, stars_5)
+        SELECT product_id, SUM(rating), COUNT(*),
+               COUNT(*) FILTER (WHERE rating = 1), COUNT(*) FILTER (WHERE rating = 2), COUNT(*) FILTER (WHERE rating = 3),
+               COUNT(*) FILTER (WHERE rating = 4), COUNT(*) FILTER (WHERE rating = 5)
+        FROM reviews GROUP BY product_id
+    """)
+    cursor.execute("""
+        UPDATE products p SET rating = ROUND(s.rating_sum::numeric / s.rating_count, 1), num_ratings = s.rating_count
+        FROM product_rating_stats s
+        WHERE p.id = s.product_id
+    """)
     print("Ratings updated.")
     
     create_dedicated_test_user(cursor)
@@ -164,7 +186,12 @@ def setup_database():
     conn.commit()
     cursor.close()
     conn.close()
-    print("Database setup complete and connection closed.")
+    print(f"Database setup complete in {time.perf_counter() - started:.2f}s and connection closed.")
+    return True
 
 if __name__ == '__main__':
-    setup_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Seed the AURA database with demo data.")
+    parser.add_argument("--reset", action="store_true", help="drop every table first (destroys all data)")
+    args = parser.parse_args()
+    setup_database(reset=args.reset)
+    sys.exit(0)
\ No newline at end of file
@@ -3,9 +3,15 @@
 # Exit immediately if a command exits with a non-zero status.
 set -e
 
-echo "--- RUNNING DATABASE SETUP ---"
-python setup_database.py
-echo "--- DATABASE SETUP COMPLETE ---"
+# Only checks the schema version (and applies new migrations on a deploy).
+# Demo data is never reseeded on boot; run `python setup_database.py` by hand,
+# or set SEED_DATABASE=1 to seed an empty database on first start.
+echo "--- CHECKING DATABASE SCHEMA ---"
+python migrations.py --boot
+if [ "${SEED_DATABASE:-0}" = "1" ]; then
+    python setup_database.py
+fi
+echo "--- DATABASE READY ---"
 
 echo "--- STARTING GUNICORN SERVER ---"
-gunicorn -w 1 -k eventlet app:app
\ No newline at end of file
+gunicorn -w 1 -k eventlet wsgi:app
\ No newline at end of file
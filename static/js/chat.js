@@ -120,7 +120,7 @@ document.addEventListener('DOMContentLoaded', () => {
             data.products.forEach(product => {
                 const productCard = document.createElement('li');
                 productCard.className = 'bot-product-card-container';
-                const imageUrl = `/static/images/products/${product.image_url}`;
+                const imageUrl = product.image_src || `/static/images/products/${product.image_url}`;
                 const productUrl = `/product/${product.id}`;
 
                 productCard.innerHTML = `
@@ -142,7 +142,7 @@ document.addEventListener('DOMContentLoaded', () => {
             orderGrid.className = 'bot-order-grid-container';
             
             data.orders.forEach(order => {
-                const imageUrl = `/static/images/products/${order.image_url}`;
+                const imageUrl = order.image_src || `/static/images/products/${order.image_url}`;
                 // In a real app, this would link to the order details page
                 const orderUrl = `/order/${order.id}`;
 
@@ -159,7 +159,7 @@ document.addEventListener('DOMContentLoaded', () => {
                             resultItem.href = `/product/${product.id}`;
                             resultItem.className = 'search-result-item';
                             resultItem.innerHTML = `
-                                <img src="/static/images/products/${product.image_url}" alt="${product.name}">
+                                <img src="${product.image_src || `/static/images/products/${product.image_url}`}" alt="${product.name}">
                                 <div class="search-result-info">
                                     <span class="brand">${product.brand}</span>
                                     <span class="name">${product.name}</span>
@@ -248,4 +248,50 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- END: CONSOLIDATED MOBILE UI LOGIC ---
+
+    // --- Product Listing: Infinite Scroll ---
+    // Each page carries an opaque cursor for the next one; the current filters,
+    // search and sort are taken from the page URL so every page matches.
+    const productGrid = document.getElementById('product-grid');
+    const loadMoreContainer = document.getElementById('products-load-more');
+
+    if (productGrid && loadMoreContainer) {
+        const loadMoreBtn = document.getElementById('products-load-more-btn');
+        let loading = false;
+
+        const loadNextPage = () => {
+            const cursor = loadMoreContainer.dataset.nextCursor;
+            if (loading || !cursor) return;
+            loading = true;
+            loadMoreBtn.disabled = true;
+
+            const params = new URLSearchParams(window.location.search);
+            params.set('cursor', cursor);
+            fetch(`/products/page?${params.toString()}`)
+                .then(response => response.json())
+                .then(data => {
+                    productGrid.insertAdjacentHTML('beforeend', data.html);
+                    if (data.next_cursor) {
+                        loadMoreContainer.dataset.nextCursor = data.next_cursor;
+                    } else {
+                        observer && observer.disconnect();
+                        loadMoreContainer.remove();
+                    }
+                })
+                .catch(error => console.error('Error:', error))
+                .finally(() => {
+                    loading = false;
+                    loadMoreBtn.disabled = false;
+                });
+        };
+
+        loadMoreBtn.addEventListener('click', loadNextPage);
+        // Fetch the next page a little before the shopper reaches the end of the grid.
+        const observer = 'IntersectionObserver' in window
+            ? new IntersectionObserver(entries => {
+                if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+            }, { rootMargin: '600px 0px' })
+            : null;
+        if (observer) observer.observe(loadMoreContainer);
+    }
 });
\ No newline at end of file
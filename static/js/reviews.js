@@ -5,11 +5,11 @@ document.addEventListener('DOMContentLoaded', () => {
     if (loadMoreBtn) {
         loadMoreBtn.addEventListener('click', () => {
             const productId = loadMoreBtn.dataset.productId;
-            let nextPage = parseInt(loadMoreBtn.dataset.nextPage);
+            const nextCursor = loadMoreBtn.dataset.nextCursor;
             const sortBy = loadMoreBtn.dataset.sort;
 
-            // Fetch the next page of reviews from our new route
-            fetch(`/get_reviews/${productId}?page=${nextPage}&sort=${sortBy}`)
+            // Fetch the page after the last review shown; the cursor is opaque to us
+            fetch(`/get_reviews/${productId}?sort=${encodeURIComponent(sortBy)}&cursor=${encodeURIComponent(nextCursor)}`)
                 .then(response => response.json())
                 .then(data => {
                     if (data.reviews.length > 0) {
@@ -34,10 +34,11 @@ document.addEventListener('DOMContentLoaded', () => {
                             `;
                             reviewsList.appendChild(reviewCard);
                         });
-                        // Increment the page number for the next click
-                        loadMoreBtn.dataset.nextPage = nextPage + 1;
+                    }
+                    if (data.next_cursor) {
+                        loadMoreBtn.dataset.nextCursor = data.next_cursor;
                     } else {
-                        // If no more reviews are returned, hide the button
+                        // That was the last page
                         loadMoreBtn.textContent = 'No More Reviews';
                         loadMoreBtn.disabled = true;
                     }
@@ -7,7 +7,11 @@ import eventlet
 # to work correctly from within a Socket.IO event handler.
 eventlet.monkey_patch()
 
-from app import app, socketio
+from app import app, socketio, warm_up
+
+# The server entry point starts the pool, catalog and background loops;
+# importing app on its own doesn't.
+warm_up()
 
 if __name__ == "__main__":
     socketio.run(app)
\ No newline at end of file